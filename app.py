@@ -3,8 +3,9 @@
 import os
 
 from flask import Flask, request, send_from_directory
-from main import handleHttp
-from parser import initialize_parser
+from main import handleHttp, handleBatch, handleJsonRoll
+import metrics
+import warmup
 
 app = Flask(__name__)
 @app.route('/v1', methods=["POST"])
@@ -14,6 +15,32 @@ def entry():
     return handleHttp(request)
 
 
+@app.route('/v1/roll', methods=["POST"])
+def json_roll():
+    body, status = handleJsonRoll(request)
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+@app.route('/v1/batch', methods=["POST"])
+def batch():
+    body, status = handleBatch(request)
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return app.response_class(metrics.render(),
+                              content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/ready')
+def ready():
+    """200 once warmup.warm_up has finished, 503 until then."""
+    if warmup.is_ready():
+        return "ready"
+    return app.response_class("warming up", status=503)
+
+
 @app.route('/v1/openapi.yaml')
 def openapi():
     return send_from_directory('static', 'openapi.yaml')
@@ -25,5 +52,5 @@ def dialogflow_openapi():
 
 
 if __name__ == "__main__":
-    initialize_parser()
+    warmup.warm_up()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Compares per request latency of the Dialogflow webhook and JSON APIs.
+
+Requests go through Flask's test client, so this measures the server side
+work without any network.
+"""
+
+import statistics
+import time
+from typing import Callable, List
+
+from absl import app as absl_app
+from absl import flags
+
+from app import app
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer("iterations", 200, "Requests per spec and endpoint.")
+flags.DEFINE_list("specs", ["3d20 + 5", "fireball at level 5",
+                            "1d20 with advantage"], "Dice specs to roll.")
+
+
+def time_requests(post: Callable[[], None], iterations: int) -> List[float]:
+    post()  # warm up caches
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        post()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(argv):
+    del argv  # unused
+    client = app.test_client()
+    for dice_spec in FLAGS.specs:
+        endpoints = {
+            "/v1 (dialogflow)": lambda: client.post("/v1", json={
+                "queryResult": {"action": "roll",
+                                "parameters": {"dice_spec": dice_spec}}}),
+            "/v1/roll (json)": lambda: client.post(
+                "/v1/roll", json={"dice_spec": dice_spec}),
+        }
+        for name, post in endpoints.items():
+            times = time_requests(post, FLAGS.iterations)
+            print("%-25s %-18s mean %7.1fus  p50 %7.1fus" % (
+                dice_spec, name, statistics.mean(times) * 1e6,
+                statistics.median(times) * 1e6))
+
+
+if __name__ == "__main__":
+    absl_app.run(main)
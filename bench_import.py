@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Measures how long importing the server takes, as a cold start would.
+
+Each run imports the module in a fresh interpreter with -X importtime and
+reports the total along with the slowest modules, counting their imports.
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from absl import app as absl_app
+from absl import flags
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("module", "app", "Module to import.")
+flags.DEFINE_integer("runs", 5, "Fresh interpreters to time the import in.")
+flags.DEFINE_integer("top", 15, "Slowest modules to list.")
+flags.DEFINE_string("json_output", None,
+                    "Also write the results as JSON to this file.")
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Returns the cumulative import time of each module in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(argv):
+    del argv  # unused
+    runs = [import_times(FLAGS.module) for _ in range(FLAGS.runs)]
+    totals = [run[FLAGS.module] for run in runs]
+    slowest: List[Tuple[str, int]] = sorted(
+        ((name, int(statistics.median(run.get(name, 0) for run in runs)))
+         for name in runs[0] if name != FLAGS.module),
+        key=lambda item: -item[1])[:FLAGS.top]
+    print("import %s: median %.1fms  min %.1fms over %d runs" % (
+        FLAGS.module, statistics.median(totals) / 1e3, min(totals) / 1e3,
+        len(totals)))
+    for name, us in slowest:
+        print("  %8.1fms  %s" % (us / 1e3, name))
+    if FLAGS.json_output:
+        with open(FLAGS.json_output, "w") as f:
+            json.dump({"module": FLAGS.module, "total_us": totals,
+                       "slowest": dict(slowest)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    absl_app.run(main)
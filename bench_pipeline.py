@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the parser, each stage of resolving and roll().
+
+Runs offline, without Flask or any network. Results can be saved as a JSON
+baseline, and later runs compared against it to catch regressions:
+
+  python3 bench_pipeline.py --output=baseline.json
+  python3 bench_pipeline.py --baseline=baseline.json
+
+Comparing exits with status 1 if any benchmark got slower by more than
+--threshold.
+"""
+
+import json
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+from absl import app as absl_app
+from absl import flags
+from absl import logging
+
+from dice_calculator import roll, resolve, PLAN_CACHE
+from ir import apply_crit, evaluate, from_tree, resolve_names, simplify
+from knowledge import named_damage
+from parser import compile_parsers, get_parser, parse
+from transformers import EvalDice
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer("repeats", 5, "Times to repeat each benchmark. The "
+                     "fastest repeat is reported.")
+flags.DEFINE_float("min_time", 0.05,
+                   "Minimum seconds each repeat of a benchmark runs for.")
+flags.DEFINE_string("output", None, "Write the results as JSON to this file.")
+flags.DEFINE_string("baseline", None,
+                    "Compare against results previously written by --output.")
+flags.DEFINE_float("threshold", 0.2, "Fraction slower than the baseline "
+                   "that counts as a regression.")
+flags.DEFINE_list("filter", [], "Only run benchmarks whose name contains "
+                  "one of these.")
+
+CORPUS = {
+    "plain": ["3d20 + 5", "2d6 plus 4", "(1+2)*3", "d20", "4d6 - 2",
+              "2d(1d4)"],
+    "named_dice": ["2 6 sided dice", "3 cube", "death saving throw",
+                   "percentile", "2 icosahedron plus 1"],
+    "weapons": ["longsword", "greataxe * 2", "crossbow, light + 3",
+                "crossbow hand"],
+    "spells": ["fireball", "fireball at level 5", "level 9 fireball",
+               "disintegrate at 7th level", "acid arrow at level 4"],
+    "critical": ["critical to hit with a longsword",
+                 "critical hit with a fireball", "critical magic missile"],
+    "advantage": ["1d20 with advantage", "1d20 with disadvantage",
+                  "1d20 with advantage + 5"],
+}
+
+
+def time_per_op(func: Callable[[], Any], ops: int) -> float:
+    """Returns the fastest seconds per op of func, which does ops ops."""
+    func()  # warm up caches
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= FLAGS.min_time:
+            break
+        loops *= 2
+    best = elapsed / loops
+    for _ in range(FLAGS.repeats - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best / ops
+
+
+def over(specs: Sequence[Any],
+         func: Callable[[Any], Any]) -> Callable[[], None]:
+    def run():
+        for spec in specs:
+            func(spec)
+    return run
+
+
+def benchmarks() -> Dict[str, Any]:
+    """Returns (function, ops per call) pairs keyed by benchmark name."""
+    benches = {
+        "compile_parsers": (compile_parsers, 1),
+    }
+    for category, specs in CORPUS.items():
+        # The input each stage gets when rolling specs
+        parsed = [parse(s) for s in specs]
+        lowered = [from_tree(t) for t in parsed]
+        known = [resolve_names(n, named_damage) for n in lowered]
+        simplified = [simplify(n) for n in known]
+        crit = [apply_crit(n) for n in simplified]
+
+        def uncached_resolve(spec):
+            PLAN_CACHE.clear()
+            resolve(spec)
+
+        benches.update({
+            f"parse.{category}": (over(specs, parse), len(specs)),
+            f"earley_parse.{category}": (
+                over(specs, get_parser().parse), len(specs)),
+            # Named after the stage metrics in dice_calculator
+            f"number_transform.{category}": (
+                over(parsed, from_tree), len(specs)),
+            f"dnd_knowledge.{category}": (
+                over(lowered, lambda n: resolve_names(n, named_damage)),
+                len(specs)),
+            f"simplify.{category}": (over(known, simplify), len(specs)),
+            f"crit_transform.{category}": (
+                over(simplified, apply_crit), len(specs)),
+            f"eval_dice.{category}": (
+                over(crit, lambda n: evaluate(n, EvalDice())), len(specs)),
+            f"resolve_uncached.{category}": (
+                over(specs, uncached_resolve), len(specs)),
+            f"roll.{category}": (over(specs, roll), len(specs)),
+        })
+    return benches
+
+
+def run_benchmarks(names_containing: Sequence[str]) -> Dict[str, float]:
+    """Returns microseconds per op of each benchmark."""
+    results = {}
+    for name, (func, ops) in benchmarks().items():
+        if names_containing and not any(f in name for f in names_containing):
+            continue
+        results[name] = time_per_op(func, ops) * 1e6
+        logging.info("%s: %.2fus", name, results[name])
+    return results
+
+
+def compare(baseline: Dict[str, float], results: Dict[str, float],
+            threshold: float) -> List[str]:
+    """Returns the names of benchmarks slower than baseline by threshold."""
+    return [name for name, us in results.items()
+            if name in baseline and us > baseline[name] * (1 + threshold)]
+
+
+def main(argv):
+    del argv  # unused
+    baseline = None
+    if FLAGS.baseline:
+        with open(FLAGS.baseline) as f:
+            baseline = json.load(f)["us_per_op"]
+    results = run_benchmarks(FLAGS.filter)
+    regressions = []
+    if baseline is not None:
+        regressions = compare(baseline, results, FLAGS.threshold)
+    for name, us in results.items():
+        line = "%-34s %10.2fus" % (name, us)
+        if baseline is not None and name in baseline:
+            line += "  %+6.1f%%" % ((us / baseline[name] - 1) * 100)
+            if name in regressions:
+                line += "  REGRESSION"
+        print(line)
+    if FLAGS.output:
+        with open(FLAGS.output, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "us_per_op": results}, f, indent=2, sort_keys=True)
+    if regressions:
+        print("%d of %d benchmarks regressed by more than %d%%" % (
+            len(regressions), len(results), FLAGS.threshold * 100))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    absl_app.run(main)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import operator
+from typing import Any, Callable, List, Tuple, Union
+
+from ir import fold, Node, ADD, ROLL_N, SUB
+from sampling import check_dice, roll_dice, dice_total, DiceResults
+
+# A compiled node: either a constant or a function of (rng, dice_results)
+# that draws its dice, adds them to dice_results and returns its value.
+_Compiled = Union[int, Callable[[Any, DiceResults], int]]
+
+CompiledRoll = Callable[..., Tuple[int, DiceResults]]
+
+_OPERATIONS = {
+    "add": operator.add,
+    "sub": operator.sub,
+    "mul": operator.mul,
+    "max": max,
+    "min": min,
+}
+
+
+def _roll(rng, dice_results: DiceResults, count: int, sides: int) -> int:
+    rolls = roll_dice(count, sides, rng)
+    dice_results.extend(rolls)
+    return dice_total(rolls)
+
+
+def _compile_roll_n(count: _Compiled, sides: _Compiled) -> _Compiled:
+    if not callable(count) and not callable(sides):
+        check_dice(count, sides)
+        return lambda rng, dice_results: _roll(
+            rng, dice_results, count, sides)
+
+    def roll_n(rng, dice_results):
+        n = count(rng, dice_results) if callable(count) else count
+        s = sides(rng, dice_results) if callable(sides) else sides
+        check_dice(n, s)
+        return _roll(rng, dice_results, n, s)
+    return roll_n
+
+
+class _Sum:
+    """A compiled add or sub, which rolls the chain of adds and subs under it
+    in a loop rather than recursing a level for each."""
+    __slots__ = ("left", "right", "sign", "_terms")
+
+    def __init__(self, left: _Compiled, right: _Compiled, sign: int):
+        self.left = left
+        self.right = right
+        self.sign = sign
+        self._terms = None
+
+    def terms(self) -> List[Tuple[int, _Compiled]]:
+        """The (sign, term) of each operand that isn't itself a sum, in the
+        order EvalDice would evaluate them."""
+        if self._terms is None:
+            terms = []
+            stack = [(self, 1)]
+            while stack:
+                compiled, sign = stack.pop()
+                if isinstance(compiled, _Sum):
+                    stack.append((compiled.right, sign * compiled.sign))
+                    stack.append((compiled.left, sign))
+                else:
+                    terms.append((sign, compiled))
+            # Only the outermost sum of a chain is ever called, so this is
+            # built once per chain
+            self._terms = terms
+        return self._terms
+
+    def __call__(self, rng, dice_results: DiceResults) -> int:
+        total = 0
+        for sign, term in self.terms():
+            value = term(rng, dice_results) if callable(term) else term
+            total = total + value if sign > 0 else total - value
+        return total
+
+
+def _compile_operation(
+        op: Callable[[int, int], int], a: _Compiled, b: _Compiled
+) -> _Compiled:
+    if callable(a) and callable(b):
+        return lambda rng, dice_results: op(
+            a(rng, dice_results), b(rng, dice_results))
+    if callable(a):
+        return lambda rng, dice_results: op(a(rng, dice_results), b)
+    if callable(b):
+        return lambda rng, dice_results: op(a, b(rng, dice_results))
+    # Constant folding
+    return op(a, b)
+
+
+def _compile_node(node: Node, a: _Compiled, b: _Compiled) -> _Compiled:
+    if node.op == ROLL_N:
+        return _compile_roll_n(a, b)
+    if node.op in (ADD, SUB) and (callable(a) or callable(b)):
+        return _Sum(a, b, 1 if node.op == ADD else -1)
+    try:
+        op = _OPERATIONS[node.op]
+    except KeyError:
+        raise ValueError(f"Can't compile {node.op} nodes") from None
+    return _compile_operation(op, a, b)
+
+
+def _compile(node: Any) -> _Compiled:
+    # A compiled node rolls afresh each time it is called, so shared nodes
+    # need only be compiled once
+    return fold(node, _compile_node, shared=True)
+
+
+def compile_tree(node: Any) -> CompiledRoll:
+    """Compiles resolved ir into a function of an optional RNG.
+
+    The ir may only contain roll_n, add, sub, mul, max and min nodes and
+    integers, i.e. it must have been through apply_crit. The returned
+    function gives the same (total, dice_results) as EvalDice would, drawing
+    dice from the given RNG (see sampling.roll_dice) in the same order.
+    """
+    compiled = _compile(node)
+    if not callable(compiled):
+        return lambda rng=None: (compiled, DiceResults())
+
+    def compiled_roll(rng=None):
+        dice_results = DiceResults()
+        return compiled(rng, dice_results), dice_results
+    return compiled_roll
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Bounds how much work a request can be before any of it is done.
+
+check_fallback_length runs before a spec the fast parser rejected is handed
+to the Earley parser, whose time grows much faster than the spec's length.
+check_shape runs straight after parsing and walks the tree without
+recursing, so it is safe on trees far too deep for the later stages.
+check_cost runs on the resolved ir, and also bounds the number of dice it
+could draw, using the range each node's value could take.
+
+Depth doesn't count an add or sub directly under another, as the compiler
+rolls chains of them in a loop, so a long sum is only bounded by its size.
+"""
+
+import os
+from typing import Any, NamedTuple, Tuple
+
+from lark import Tree
+
+from exceptions import TooExpensiveError
+from ir import fold, Node
+from metrics import Counter, Gauge
+
+MAX_DICE = int(os.environ.get("MAX_DICE", "100000"))
+# Compiled rolls recurse a frame or two per level, other than within sums,
+# against the 5000 recursion limit parser.py sets.
+MAX_TREE_DEPTH = int(os.environ.get("MAX_TREE_DEPTH", "500"))
+MAX_TREE_NODES = int(os.environ.get("MAX_TREE_NODES", "10000"))
+# Characters, taking the Earley parser about 0.2 seconds at worst. Specs that
+# parse without it are only bounded by MAX_TREE_NODES.
+MAX_FALLBACK_SPEC_LENGTH = int(
+    os.environ.get("MAX_FALLBACK_SPEC_LENGTH", "64"))
+
+_SUMS = ("add", "sub")
+
+# Value ranges saturate here, so that bounds stay cheap to work out however
+# silly the request.
+_LIMIT = 1 << 128
+
+BUDGETS = Gauge("dice_roll_budget",
+                "Most dice, tree depth, tree nodes or characters needing the "
+                "slow parser a roll may have.",
+                ["budget"])
+BUDGETS.labels("dice").set(MAX_DICE)
+BUDGETS.labels("tree_depth").set(MAX_TREE_DEPTH)
+BUDGETS.labels("tree_nodes").set(MAX_TREE_NODES)
+BUDGETS.labels("fallback_spec_length").set(MAX_FALLBACK_SPEC_LENGTH)
+REJECTIONS = Counter("dice_roll_rejections_total",
+                     "Rolls rejected for going over a budget.", ["budget"])
+
+
+class Cost(NamedTuple):
+    # Most dice that could be drawn, or 0 if the tree isn't resolved yet
+    dice: int
+    depth: int
+    # Counting shared nodes once for every time they are evaluated
+    nodes: int
+
+
+# (low, high, dice, depth, nodes) of a node, where its value is somewhere in
+# [low, high].
+_Bounds = Tuple[int, int, int, int, int]
+
+
+def _clamp(value: int) -> int:
+    return max(-_LIMIT, min(_LIMIT, value))
+
+
+def _range(op: str, a: _Bounds, b: _Bounds) -> Tuple[int, int]:
+    if op == "roll_n":
+        # Every die shows at least 1, and non-positive counts or sides are
+        # an error rather than a value.
+        return max(a[0], 1), max(a[1], 0) * max(b[1], 0)
+    if op == "add":
+        return a[0] + b[0], a[1] + b[1]
+    if op == "sub":
+        return a[0] - b[1], a[1] - b[0]
+    if op == "mul":
+        products = (a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1])
+        return min(products), max(products)
+    if op == "max":
+        return max(a[0], b[0]), max(a[1], b[1])
+    if op == "min":
+        return min(a[0], b[0]), min(a[1], b[1])
+    raise ValueError(f"Can't estimate {op} nodes")
+
+
+def _leaf(value: Any) -> _Bounds:
+    if isinstance(value, tuple):
+        return value
+    return value, value, 0, 1, 1
+
+
+def _child_depth(node: Node, child: Any, depth: int) -> int:
+    if node.op in _SUMS and isinstance(child, Node) and child.op in _SUMS:
+        return depth
+    return depth + 1
+
+
+def _estimate(node: Node, a: Any, b: Any) -> _Bounds:
+    a, b = _leaf(a), _leaf(b)
+    low, high = _range(node.op, a, b)
+    dice = a[2] + b[2]
+    if node.op == "roll_n":
+        dice = min(_LIMIT, dice + max(a[1], 0))
+    depth = max(_child_depth(node, node.left, a[3]),
+                _child_depth(node, node.right, b[3]))
+    return _clamp(low), _clamp(high), dice, depth, 1 + a[4] + b[4]
+
+
+def estimate_cost(node: Any) -> Cost:
+    """Works out the cost of resolved ir in O(distinct nodes)."""
+    _, _, dice, depth, nodes = _leaf(fold(node, _estimate, shared=True))
+    return Cost(dice, depth, nodes)
+
+
+def _reject(budget: str, message: str):
+    REJECTIONS.labels(budget).inc()
+    raise TooExpensiveError(message)
+
+
+def check_fallback_length(dice_spec: str):
+    """Rejects specs too long to parse with the Earley parser."""
+    if len(dice_spec) > MAX_FALLBACK_SPEC_LENGTH:
+        _reject("fallback_spec_length",
+                "Sorry, that's too long for me to understand")
+
+
+def tree_shape(tree: Any) -> Cost:
+    """Works out just the depth and nodes of an unshared tree, quickly."""
+    depth = nodes = 0
+    stack = [(tree, 1)]
+    while stack:
+        node, node_depth = stack.pop()
+        nodes += 1
+        if node_depth > depth:
+            depth = node_depth
+        if isinstance(node, Tree):
+            for child in node.children:
+                if (node.data in _SUMS and isinstance(child, Tree) and
+                        child.data in _SUMS):
+                    stack.append((child, node_depth))
+                else:
+                    stack.append((child, node_depth + 1))
+    return Cost(0, depth, nodes)
+
+
+def _check_shape(cost: Cost):
+    if cost.depth > MAX_TREE_DEPTH:
+        _reject("tree_depth",
+                "Sorry, that's nested too deeply for me to work out")
+    if cost.nodes > MAX_TREE_NODES:
+        _reject("tree_nodes", "Sorry, that's too long for me to work out")
+
+
+def check_shape(tree: Any) -> Cost:
+    """Rejects parse trees too deep or big to transform safely."""
+    cost = tree_shape(tree)
+    _check_shape(cost)
+    return cost
+
+
+def check_cost(node: Any) -> Cost:
+    """Rejects resolved ir that is too big or could draw too many dice."""
+    cost = estimate_cost(node)
+    _check_shape(cost)
+    if cost.dice > MAX_DICE:
+        _reject("dice", "Sorry, I can only roll up to %d dice at once" %
+                MAX_DICE)
+    return cost
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Rolls the dice spec on each line of a file, writing a JSON line for each.
+
+  python3 dice_batch.py --input=specs.txt > results.jsonl
+
+Each line of output is a roll_batch result, in the same order as the specs.
+"""
+
+import os
+import sys
+from typing import Sequence
+
+from absl import app as absl_app
+from absl import flags
+
+from dice_calculator import roll_lines, BATCH_CHUNK_SIZE
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("input", "-", "File to read dice specs from, or - for "
+                    "stdin.")
+flags.DEFINE_integer("processes", os.cpu_count(),
+                     "Processes to roll dice specs in.")
+flags.DEFINE_integer("chunk_size", BATCH_CHUNK_SIZE,
+                     "Dice specs to hand each process at a time.")
+
+
+def main(argv: Sequence[str]):
+    if len(argv) > 1:
+        raise absl_app.UsageError(
+            "Dice specs are read from --input, not the command line")
+    lines = sys.stdin if FLAGS.input == "-" else open(FLAGS.input)
+    try:
+        for results in roll_lines(lines, FLAGS.processes, FLAGS.chunk_size):
+            sys.stdout.write(results)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+if __name__ == '__main__':
+    absl_app.run(main)
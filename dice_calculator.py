@@ -1,54 +1,346 @@
 #!/usr/bin/env python3
 
 from absl import logging
-from lark.exceptions import LarkError, VisitError
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from lark.exceptions import LarkError
+import json
+import os
 import sys
-from typing import Sequence, Tuple
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+    Sequence, Tuple, TYPE_CHECKING)
 from opencensus.trace import execution_context
 
-from parser import get_parser
+from cache import LRUCache
+from compiler import compile_tree, CompiledRoll
+from cost import check_fallback_length, check_shape, check_cost
+from ir import (
+    apply_crit, digest, from_tree, resolve_names, simplify, Node,
+    ADVANTAGE, DISADVANTAGE)
+from knowledge import get_damage_table, named_damage
+from metrics import Counter, Gauge, Histogram
+from parser import get_fast_parser, get_parser, parse
 from util import pprint
-from exceptions import RecognitionError
-from transformers import (
-    NumberTransformer, SimplifyTransformer, DnD5eKnowledge, CritTransformer,
-    EvalDice)
+from exceptions import RecognitionError, UnfulfillableRequestError
+from sampling import DiceResults
 
+if TYPE_CHECKING:
+    from distribution import Distribution
+    from simulation import Simulation
 
-def roll(dice_spec: str) -> Tuple[int, Sequence[int]]:
+
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", "1024"))
+# Responses list every die up to this many, and summarize them beyond it
+MAX_LISTED_DICE = int(os.environ.get("MAX_LISTED_DICE", "100"))
+# Descriptions read every die out up to this many
+MAX_DESCRIBED_DICE = 10
+# How many of the highest and lowest dice summaries give
+SUMMARIZED_DICE = 3
+# Lines that roll_lines hands a worker at a time. Bigger chunks spend less
+# time passing work between processes.
+BATCH_CHUNK_SIZE = 256
+
+
+class Plan(NamedTuple):
+    # The ir after apply_crit, which shares nodes with the damage table
+    ir: Any
+    # compile_tree(ir)
+    roll: CompiledRoll
+    # digest(ir), which follow-up requests use to refer back to the plan
+    id: str
+
+
+# Plans keyed by normalize_spec(dice_spec)
+PLAN_CACHE = LRUCache(PLAN_CACHE_SIZE)
+# The same plans keyed by Plan.id, and plans modified by follow-ups keyed
+# by (the original Plan.id, modifier)
+PLANS_BY_ID = LRUCache(PLAN_CACHE_SIZE)
+
+PLAN_CACHE_EVENTS = Counter(
+    "dice_plan_cache_events_total", "Plan cache hits, misses and evictions.",
+    ["cache", "event"])
+PLAN_CACHE_ENTRIES = Gauge(
+    "dice_plan_cache_entries", "Plans cached, and the most that can be.",
+    ["cache", "entries"])
+
+
+def _export_cache_stats(name: str, cache: LRUCache):
+    # Read when /metrics is rendered, so the caches stay as they are
+    for event, attribute in (("hit", "hits"), ("miss", "misses"),
+                             ("eviction", "evictions")):
+        PLAN_CACHE_EVENTS.set_function(
+            lambda a=attribute: getattr(cache, a), name, event)
+    PLAN_CACHE_ENTRIES.set_function(cache.__len__, name, "size")
+    PLAN_CACHE_ENTRIES.set_function(lambda: cache.maxsize, name, "maxsize")
+
+
+_export_cache_stats("spec", PLAN_CACHE)
+_export_cache_stats("id", PLANS_BY_ID)
+
+# Ways a follow-up can change how the previous roll is rolled again
+MODIFIERS = {
+    "advantage": ADVANTAGE,
+    "disadvantage": DISADVANTAGE,
+}
+
+STAGE_SECONDS = Histogram(
+    "dice_roll_stage_seconds", "Time spent in each stage of rolling dice.",
+    ["stage"])
+ROLL_ERRORS = Counter(
+    "dice_roll_errors_total", "Dice specs that couldn't be rolled, by error.",
+    ["error"])
+FOLLOWUPS = Counter(
+    "dice_roll_followups_total",
+    "Follow-up rolls, by whether the plan they refer to was still cached.",
+    ["plan"])
+
+
+def normalize_spec(dice_spec: str) -> str:
+    return " ".join(dice_spec.lower().split())
+
+
+def resolve(dice_spec: str) -> Plan:
+    """Parses a dice spec down to compiled ir of dice and arithmetic."""
     tracer = execution_context.get_opencensus_tracer()
+    dice_spec = normalize_spec(dice_spec)
+    plan = PLAN_CACHE.get(dice_spec)
+    if plan is not None:
+        return plan
     try:
-        with tracer.span('initial_parse'):
+        with tracer.span('initial_parse'), \
+                STAGE_SECONDS.labels('initial_parse').time():
             tracer.add_attribute_to_current_span("dice_spec", dice_spec)
-            tree = get_parser().parse(dice_spec)
+            tree = parse(dice_spec, before_fallback=check_fallback_length)
     except LarkError as e:
         raise RecognitionError(
             "Sorry, I couldn't understand your request") from e
-    logging.debug("Initial parse tree:\n%s", pprint(tree))
+    with STAGE_SECONDS.labels('admission').time():
+        check_shape(tree)
+    if logging.level_debug():
+        logging.debug("Initial parse tree:\n%s", pprint(tree))
+    # The stages keep their Lark transformer names, for the metrics
+    with STAGE_SECONDS.labels('number_transform').time():
+        ir = from_tree(tree)
+    with tracer.span('dnd_knowledge'), \
+            STAGE_SECONDS.labels('dnd_knowledge').time():
+        ir = resolve_names(ir, named_damage)
+    with STAGE_SECONDS.labels('simplify').time():
+        ir = simplify(ir)
+    with tracer.span('crit_transform'), \
+            STAGE_SECONDS.labels('crit_transform').time():
+        ir = apply_crit(ir)
+    logging.debug("Resolved to %r", ir)
+    plan = _plan(ir)
+    PLAN_CACHE.put(dice_spec, plan)
+    return plan
+
+
+def _plan(ir: Any) -> Plan:
+    # Before any dice are drawn
+    with STAGE_SECONDS.labels('admission').time():
+        check_cost(ir)
+    with STAGE_SECONDS.labels('compile').time():
+        plan = Plan(ir, compile_tree(ir), digest(ir))
+    PLANS_BY_ID.put(plan.id, plan)
+    return plan
+
+
+def followup_plan(plan_id: Optional[str], dice_spec: Optional[str],
+                  modifier: Optional[str] = None) -> Plan:
+    """Returns the plan for rolling an earlier roll again.
+
+    The earlier plan is looked up by its id, and dice_spec only resolved
+    again if it has been evicted. Ids hash the plan's content, so are the
+    same in every process that resolves the same spec. modifier, if given,
+    is one of MODIFIERS to apply to the earlier plan. That should be the
+    plan of dice_spec itself, not one already modified, so that modifiers
+    replace each other rather than stacking.
+    """
+    plan = PLANS_BY_ID.get(plan_id) if plan_id else None
+    FOLLOWUPS.labels("hit" if plan is not None else "miss").inc()
+    if plan is None:
+        if not isinstance(dice_spec, str):
+            raise RecognitionError(
+                "Sorry, I don't remember what you rolled last time")
+        plan = resolve(dice_spec)
+    if not modifier:
+        return plan
+    try:
+        op = MODIFIERS[modifier]
+    except KeyError:
+        raise RecognitionError(
+            f"Sorry, I don't know how to roll with {modifier}") from None
+    modified = PLANS_BY_ID.get((plan.id, modifier))
+    if modified is None:
+        with STAGE_SECONDS.labels('crit_transform').time():
+            ir = apply_crit(Node(op, plan.ir))
+        modified = _plan(ir)
+        PLANS_BY_ID.put((plan.id, modifier), modified)
+    return modified
+
+
+def _roll_plan(get_plan: Callable[[], Plan]
+               ) -> Tuple[Plan, int, DiceResults]:
+    tracer = execution_context.get_opencensus_tracer()
     try:
-        tree = NumberTransformer().transform(tree)
-        with tracer.span('dnd_knowledge'):
-            tree = DnD5eKnowledge().transform(tree)
-        tree = SimplifyTransformer().transform(tree)
-        with tracer.span('crit_transform'):
-            tree = CritTransformer().transform(tree)
-        logging.debug("DnD transformed parse tree:\n%s", pprint(tree))
-        with tracer.span('final_eval'):
-            transformer = EvalDice()
-            tree = transformer.transform(tree)
-        tree = SimplifyTransformer().transform(tree)
-    except VisitError as e:
-        #  Get our nice exception out of lark's wrapper
-        raise e.orig_exc
-    return (tree.children[0], transformer.dice_results)
-
-
-def describe_dice(dice_results: Sequence[int]) -> str:
+        plan = get_plan()
+        with tracer.span('final_eval'), \
+                STAGE_SECONDS.labels('final_eval').time():
+            total, dice = plan.roll()
+    except UnfulfillableRequestError as e:
+        ROLL_ERRORS.labels(type(e).__name__).inc()
+        raise
+    return plan, total, dice
+
+
+def roll_with_plan(dice_spec: str) -> Tuple[Plan, int, DiceResults]:
+    """Like roll, but also returns the plan, for follow-ups to refer to."""
+    return _roll_plan(lambda: resolve(dice_spec))
+
+
+def roll(dice_spec: str) -> Tuple[int, DiceResults]:
+    _, total, dice = roll_with_plan(dice_spec)
+    return total, dice
+
+
+def reroll(plan_id: Optional[str], dice_spec: Optional[str],
+           modifier: Optional[str] = None) -> Tuple[Plan, int, DiceResults]:
+    """Rolls followup_plan(...), returning it too for further follow-ups."""
+    return _roll_plan(lambda: followup_plan(plan_id, dice_spec, modifier))
+
+
+def distribution(dice_spec: str) -> 'Distribution':
+    """Works out the odds of every possible result of a dice spec."""
+    # Imported here, as only this needs it
+    from distribution import tree_distribution
+    tracer = execution_context.get_opencensus_tracer()
+    plan = resolve(dice_spec)
+    with tracer.span('distribution'):
+        return tree_distribution(plan.ir)
+
+
+def simulate(dice_spec: str, trials: int, processes: int = 1) -> 'Simulation':
+    """Rolls a dice spec many times, returning a histogram of the results."""
+    # Imported here, as only this needs it
+    from simulation import simulate
+    return simulate(dice_spec, trials, processes)
+
+
+def roll_batch(dice_specs: Sequence[Any]) -> List[Dict[str, Any]]:
+    """Rolls each spec, resolving repeated specs only once.
+
+    Each result has the dice_spec and either its total and dice_payload, or
+    the error message if it couldn't be rolled, so one bad spec doesn't
+    spoil the others.
+    """
+    tracer = execution_context.get_opencensus_tracer()
+    plans = {}
+    results = []
+    for dice_spec in dice_specs:
+        result = {"dice_spec": dice_spec}
+        results.append(result)
+        try:
+            if not isinstance(dice_spec, str):
+                raise RecognitionError(
+                    "Sorry, I can only roll dice described in words")
+            key = normalize_spec(dice_spec)
+            if key not in plans:
+                try:
+                    plans[key] = resolve(dice_spec)
+                except UnfulfillableRequestError as e:
+                    plans[key] = e
+            if isinstance(plans[key], UnfulfillableRequestError):
+                raise plans[key]
+            with tracer.span('final_eval'), \
+                    STAGE_SECONDS.labels('final_eval').time():
+                result["total"], dice_results = plans[key].roll()
+            result.update(dice_payload(dice_results))
+        except UnfulfillableRequestError as e:
+            ROLL_ERRORS.labels(type(e).__name__).inc()
+            result["error"] = str(e)
+        except Exception as e:
+            ROLL_ERRORS.labels(type(e).__name__).inc()
+            logging.exception("Failed to roll %r", dice_spec)
+            result["error"] = "Sorry, something went wrong rolling that"
+    return results
+
+
+def dice_payload(dice_results: DiceResults) -> Dict[str, Any]:
+    """Returns {"dice": [...]}, or a "dice_summary" if there are too many.
+
+    Either way the size is bounded, however many dice were rolled.
+    """
+    if len(dice_results) <= MAX_LISTED_DICE:
+        return {"dice": dice_results.tolist()}
+    highest, lowest = dice_results.extremes(SUMMARIZED_DICE)
+    return {"dice_summary": {
+        "count": len(dice_results),
+        "highest": highest,
+        "lowest": lowest,
+    }}
+
+
+def _list_dice(dice: Sequence[int]) -> str:
+    return ", ".join(str(d) for d in dice[:-1]) + " and " + str(dice[-1])
+
+
+def describe_dice(dice_results: DiceResults) -> str:
     if len(dice_results) <= 1:
         return ""
-    description = " from "
-    description += ", ".join(str(d) for d in dice_results[:-1])
-    description += " and " + str(dice_results[-1])
-    return description
+    if len(dice_results) <= MAX_DESCRIBED_DICE:
+        return " from " + _list_dice(list(dice_results))
+    highest, lowest = dice_results.extremes(SUMMARIZED_DICE)
+    return " from %d dice, the highest %s and the lowest %s" % (
+        len(dice_results), _list_dice(highest), _list_dice(lowest))
+
+
+def _initialize_batch_worker():
+    # Once per worker, rather than in the first chunk each one rolls
+    get_fast_parser()
+    get_parser()
+    get_damage_table()
+
+
+def _roll_chunk(dice_specs: List[str]) -> str:
+    return "".join(json.dumps(result, separators=(",", ":")) + "\n"
+                   for result in roll_batch(dice_specs))
+
+
+def _chunks(lines: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for line in lines:
+        chunk.append(line.rstrip("\r\n"))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def roll_lines(lines: Iterable[str], processes: int = 1,
+               chunk_size: int = BATCH_CHUNK_SIZE) -> Iterator[str]:
+    """Rolls the spec on each line, yielding JSON lines in the same order.
+
+    Each line is a roll_batch result. Chunks of lines are rolled across a
+    pool of processes, with only a few chunks per worker in flight at once,
+    so that memory stays flat however many lines there are. Each yielded
+    string holds the results for one chunk.
+    """
+    chunks = _chunks(lines, chunk_size)
+    if processes <= 1:
+        for chunk in chunks:
+            yield _roll_chunk(chunk)
+        return
+    with ProcessPoolExecutor(
+            processes, initializer=_initialize_batch_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_roll_chunk, chunk))
+            if len(pending) >= 4 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Exact probability distributions of resolved dice specs.
+
+Needs numpy, which sampling.py can do without.
+"""
+
+import functools
+from typing import Any, Dict, Iterator, Tuple, Union
+
+import numpy
+
+from exceptions import IncalculableOddsError
+from ir import evaluate
+from sampling import check_dice
+
+# Largest number of distinct outcomes we are willing to track
+MAX_SUPPORT = 10**6
+# Most probabilities mixing random numbers or sizes of dice may add up
+MAX_MIXTURE_SIZE = 10**7
+# Below this many outcomes direct convolution beats the FFT
+_FFT_THRESHOLD = 64
+
+
+def _check_support(size: int, limit: int = MAX_SUPPORT):
+    if size > limit:
+        raise IncalculableOddsError(
+            "Sorry, that has too many possible results to work out the odds")
+
+
+class Distribution:
+    """A probability mass function over offset, offset+1, ... ."""
+    __slots__ = ("offset", "pmf")
+
+    def __init__(self, offset: int, pmf: numpy.ndarray):
+        _check_support(len(pmf))
+        self.offset = offset
+        self.pmf = pmf
+
+    @classmethod
+    def constant(cls, value: int) -> 'Distribution':
+        return cls(value, numpy.ones(1))
+
+    @classmethod
+    def from_counts(cls, values: numpy.ndarray,
+                    counts: numpy.ndarray) -> 'Distribution':
+        """Returns the distribution of seeing values[i] counts[i] times."""
+        offset = int(values[0])
+        _check_support(int(values[-1]) - offset + 1)
+        pmf = numpy.zeros(int(values[-1]) - offset + 1)
+        pmf[values - offset] = counts / counts.sum()
+        return cls(offset, pmf)
+
+    @property
+    def min(self) -> int:
+        return self.offset
+
+    @property
+    def max(self) -> int:
+        return self.offset + len(self.pmf) - 1
+
+    def values(self) -> numpy.ndarray:
+        return numpy.arange(self.min, self.max + 1)
+
+    def items(self) -> Iterator[Tuple[int, float]]:
+        for i in numpy.flatnonzero(self.pmf):
+            yield self.offset + int(i), float(self.pmf[i])
+
+    def probability(self, value: int) -> float:
+        if self.min <= value <= self.max:
+            return float(self.pmf[value - self.offset])
+        return 0.0
+
+    def mean(self) -> float:
+        return float(numpy.dot(self.values(), self.pmf))
+
+    def variance(self) -> float:
+        deviation = self.values() - self.mean()
+        return float(numpy.dot(deviation * deviation, self.pmf))
+
+    def percentile(self, q: float) -> int:
+        """Returns the smallest outcome with at least q% of results <= it."""
+        cdf = numpy.cumsum(self.pmf)
+        # Allow for rounding in the cumulative sum
+        i = numpy.searchsorted(cdf, q / 100 - 1e-9)
+        return self.offset + int(min(i, len(self.pmf) - 1))
+
+    def summary(self) -> Dict[str, Union[int, float]]:
+        summary = {
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean(),
+            "variance": self.variance(),
+        }
+        for q in (5, 25, 50, 75, 95):
+            summary[f"p{q}"] = self.percentile(q)
+        return summary
+
+
+def _convolve(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    if min(len(a), len(b)) < _FFT_THRESHOLD:
+        return numpy.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    out = numpy.fft.irfft(numpy.fft.rfft(a, size) * numpy.fft.rfft(b, size),
+                          size)[:n]
+    # FFT rounding can leave tiny negative probabilities
+    numpy.clip(out, 0, None, out=out)
+    return out / out.sum()
+
+
+def _trim(offset: int, pmf: numpy.ndarray) -> Distribution:
+    nonzero = numpy.flatnonzero(pmf)
+    return Distribution(offset + int(nonzero[0]),
+                        pmf[nonzero[0]:nonzero[-1] + 1])
+
+
+def add(a: Distribution, b: Distribution) -> Distribution:
+    return Distribution(a.offset + b.offset, _convolve(a.pmf, b.pmf))
+
+
+def negate(a: Distribution) -> Distribution:
+    return Distribution(-a.max, a.pmf[::-1])
+
+
+def sub(a: Distribution, b: Distribution) -> Distribution:
+    return add(a, negate(b))
+
+
+def scale(a: Distribution, k: int) -> Distribution:
+    if k == 0:
+        return Distribution.constant(0)
+    if k < 0:
+        return scale(negate(a), -k)
+    _check_support((len(a.pmf) - 1) * k + 1)
+    pmf = numpy.zeros((len(a.pmf) - 1) * k + 1)
+    pmf[::k] = a.pmf
+    return Distribution(a.offset * k, pmf)
+
+
+def mul(a: Distribution, b: Distribution) -> Distribution:
+    if len(a.pmf) == 1:
+        return scale(b, a.offset)
+    if len(b.pmf) == 1:
+        return scale(a, b.offset)
+    _check_support(len(a.pmf) * len(b.pmf))
+    products = numpy.outer(a.values(), b.values()).ravel()
+    probabilities = numpy.outer(a.pmf, b.pmf).ravel()
+    lowest = int(products.min())
+    # Products can be spread far wider than there are of them
+    _check_support(int(products.max()) - lowest + 1)
+    pmf = numpy.bincount(products - lowest, weights=probabilities)
+    return _trim(lowest, pmf)
+
+
+def _aligned_cdfs(a: Distribution, b: Distribution):
+    lowest, highest = min(a.min, b.min), max(a.max, b.max)
+    cdfs = []
+    for d in (a, b):
+        pmf = numpy.zeros(highest - lowest + 1)
+        pmf[d.min - lowest:d.max - lowest + 1] = d.pmf
+        cdfs.append(numpy.minimum(numpy.cumsum(pmf), 1))
+    return lowest, cdfs[0], cdfs[1]
+
+
+def maximum(a: Distribution, b: Distribution) -> Distribution:
+    lowest, cdf_a, cdf_b = _aligned_cdfs(a, b)
+    return _trim(lowest, numpy.diff(cdf_a * cdf_b, prepend=0))
+
+
+def minimum(a: Distribution, b: Distribution) -> Distribution:
+    lowest, cdf_a, cdf_b = _aligned_cdfs(a, b)
+    cdf = 1 - (1 - cdf_a) * (1 - cdf_b)
+    return _trim(lowest, numpy.diff(cdf, prepend=0))
+
+
+@functools.lru_cache(maxsize=256)
+def dice(count: int, sides: int) -> Distribution:
+    """Returns the distribution of the sum of count dice with sides sides."""
+    check_dice(count, sides)
+    _check_support(count * (sides - 1) + 1)
+    if count == 1:
+        pmf = numpy.full(sides, 1 / sides)
+    else:
+        # Repeated squaring: NdS = (N//2)dS + (N//2)dS (+ 1dS)
+        half = dice(count // 2, sides).pmf
+        pmf = _convolve(half, half)
+        if count % 2:
+            pmf = _convolve(pmf, dice(1, sides).pmf)
+    # Results are shared, so stop anyone changing them
+    pmf.flags.writeable = False
+    return Distribution(count, pmf)
+
+
+def _as_distribution(value: Union[int, Distribution]) -> Distribution:
+    if isinstance(value, Distribution):
+        return value
+    return Distribution.constant(value)
+
+
+class EvalDistribution:
+    """Like EvalDice, but works out every possible result and its odds."""
+
+    def roll_n(self, count, sides):
+        count = _as_distribution(count)
+        sides = _as_distribution(sides)
+        if len(count.pmf) == 1 and len(sides.pmf) == 1:
+            return dice(count.offset, sides.offset)
+        # The number or size of the dice is itself random, so mix together
+        # the distribution for each possibility. Check the worst case first,
+        # as working out each part can take a while.
+        _check_support(max(count.max, 0) * max(sides.max, 0) -
+                       max(count.min, 1) + 1)
+        _check_support(len(count.pmf) * len(sides.pmf) *
+                       (max(count.max, 0) * max(sides.max - 1, 0) + 1),
+                       MAX_MIXTURE_SIZE)
+        parts = [(p_count * p_sides, dice(n, s))
+                 for n, p_count in count.items()
+                 for s, p_sides in sides.items()]
+        lowest = min(d.min for _, d in parts)
+        highest = max(d.max for _, d in parts)
+        _check_support(highest - lowest + 1)
+        pmf = numpy.zeros(highest - lowest + 1)
+        for p, d in parts:
+            pmf[d.min - lowest:d.max - lowest + 1] += p * d.pmf
+        return Distribution(lowest, pmf)
+
+    def add(self, a, b):
+        return add(_as_distribution(a), _as_distribution(b))
+
+    def sub(self, a, b):
+        return sub(_as_distribution(a), _as_distribution(b))
+
+    def mul(self, a, b):
+        return mul(_as_distribution(a), _as_distribution(b))
+
+    def max(self, a, b):
+        return maximum(_as_distribution(a), _as_distribution(b))
+
+    def min(self, a, b):
+        return minimum(_as_distribution(a), _as_distribution(b))
+
+
+def tree_distribution(node: Any) -> Distribution:
+    """Works out the odds of every possible result of ir node."""
+    # Every operand is independent anyway, so shared nodes need only be
+    # worked out once
+    return _as_distribution(evaluate(node, EvalDistribution(), shared=True))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+from absl import logging
+import os
+import queue
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional
+import weakref
+
+_STOP = object()
+
+# Every ErrorReporter, without keeping any alive
+_REPORTERS = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for reporter in list(_REPORTERS):
+        reporter._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    # The thread doesn't survive a fork, and neither should reports queued
+    # in the parent be sent twice.
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class ErrorReporter:
+    """Sends error reports from a background thread.
+
+    Requests only pay for putting the report on a bounded queue. If the queue
+    is full the report is dropped and counted rather than making the request
+    wait. The client is made by client_factory on the background thread the
+    first time it is needed and is then reused.
+
+    Exceptions are re-raised on the background thread and sent with the
+    client's report_exception, so they are grouped by where they were raised.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any],
+                 max_queue: int = 100, batch_size: int = 10):
+        self._client_factory = client_factory
+        self._client = None
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self.queued = 0
+        self.reported = 0
+        self.dropped = 0
+        self.failed = 0
+        _REPORTERS.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(self._max_queue)
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="ErrorReporter", daemon=True)
+            self._thread.start()
+
+    def report(self, message: str, http_context: Any = None) -> bool:
+        """Queues a message, returning False if it had to be dropped."""
+        return self._put((message, None, http_context))
+
+    def report_exception(self, http_context: Any = None) -> bool:
+        """Queues the exception being handled, with its traceback."""
+        return self._put((None, sys.exc_info()[1], http_context))
+
+    def _put(self, item) -> bool:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def _send(self, message: Optional[str],
+              exception: Optional[BaseException], http_context: Any):
+        try:
+            if self._client is None:
+                self._client = self._client_factory()
+            if exception is None:
+                self._client.report(message, http_context=http_context)
+            else:
+                self._send_exception(exception, http_context)
+        except Exception:
+            logging.exception("Failed to send error report")
+            self.failed += 1
+        else:
+            self.reported += 1
+
+    def _send_exception(self, exception: BaseException, http_context: Any):
+        # report_exception formats the exception being handled, which keeps
+        # the frames from where it was first raised.
+        try:
+            raise exception
+        except BaseException:
+            self._client.report_exception(http_context=http_context)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    self._send(*item)
+                self._queue.task_done()
+
+    def flush(self):
+        """Waits for every queued report to be sent (or fail)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self, timeout: Optional[float] = 5):
+        """Sends what is queued and stops the background thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            # The client is stalled, so give what is queued until the
+            # timeout and leave the daemon thread to die with the process
+            logging.warning("Error report queue is full while stopping")
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "reported": self.reported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -15,3 +15,11 @@ class ImpossibleSpellError(UnfulfillableRequestError):
 
 class ImpossibleDiceError(UnfulfillableRequestError):
     pass
+
+
+class IncalculableOddsError(UnfulfillableRequestError):
+    pass
+
+
+class TooExpensiveError(UnfulfillableRequestError):
+    pass
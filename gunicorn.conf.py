@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# gunicorn reads this from the working directory on start up.
+
+import gc
+import os
+
+# Import the app and warm it up in the master, before forking the workers.
+# Set PRELOAD=false to have each worker do it for itself instead.
+preload_app = os.environ.get("PRELOAD", "true").lower() in ("1", "true", "t")
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        import warmup
+        warmup.warm_up()
+        # Keep the garbage collector from touching, and so copying, the
+        # objects the workers share
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        import warmup
+        warmup.warm_up_in_background()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""A compact representation of dice specs, used from parsing onwards.
+
+Every node is a Node with an op and one or two operands, each either an int
+or another Node. Nodes are never changed once built, so the stages below
+share any subtrees they don't change rather than copying them, and a
+resolved spec is a DAG rather than a tree. All traversals are iterative, so
+depth is only bounded by the budgets in cost.py.
+"""
+
+import hashlib
+from typing import Any, Callable, List
+
+from lark import Token, Tree
+
+from parser import NAMED_DICE
+
+ROLL_N = "roll_n"
+ADD = "add"
+SUB = "sub"
+MUL = "mul"
+MAX = "max"
+MIN = "min"
+# Unary, until apply_crit removes them
+CRITICAL = "critical"
+ADVANTAGE = "advantage"
+DISADVANTAGE = "disadvantage"
+# Named damage, until resolve_names replaces them. The left operand is the
+# name as written, and the right the level to cast a spell at, or None.
+WEAPON = "weapon"
+SPELL = "spell"
+
+# Rule names that a Lark tree with one child is just a wrapper for
+_WRAPPERS = ("start", "value")
+_BINARY = (ROLL_N, ADD, SUB, MUL, MAX, MIN)
+_UNARY = (CRITICAL, ADVANTAGE, DISADVANTAGE)
+
+
+class Node:
+    __slots__ = ("op", "left", "right")
+
+    def __init__(self, op: str, left: Any, right: Any = None):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __eq__(self, other: Any) -> bool:
+        # Iterative, as these can be far deeper than the recursion limit
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if not isinstance(a, Node) or not isinstance(b, Node):
+                if isinstance(a, Node) or isinstance(b, Node) or a != b:
+                    return False
+                continue
+            if a.op != b.op:
+                return False
+            stack.append((a.right, b.right))
+            stack.append((a.left, b.left))
+        return True
+
+    def __ne__(self, other: Any) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        if self.right is None:
+            return "Node(%r, %r)" % (self.op, self.left)
+        return "Node(%r, %r, %r)" % (self.op, self.left, self.right)
+
+
+# Marks that the node under it on fold's stack has had its operands folded
+_COMBINE = object()
+
+
+def fold(node: Any, combine: Callable[[Node, Any, Any], Any],
+         shared: bool = False) -> Any:
+    """Folds node bottom up, left operand first, without recursing.
+
+    combine(node, left, right) is called with the folded operands of each
+    node, and what it returns is the folded node. Anything that isn't a Node
+    folds to itself. If shared, a node that appears more than once is only
+    folded the first time, and that result used every time.
+    """
+    if not isinstance(node, Node):
+        return node
+    memo = {} if shared else None
+    values = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if n is _COMBINE:
+            n = stack.pop()
+            right = values.pop()
+            value = combine(n, values.pop(), right)
+            if memo is not None:
+                memo[id(n)] = value
+            values.append(value)
+        elif not isinstance(n, Node):
+            values.append(n)
+        elif memo is not None and id(n) in memo:
+            values.append(memo[id(n)])
+        else:
+            stack.extend((n, _COMBINE, n.right, n.left))
+    return values[0]
+
+
+def evaluate(node: Any, visitor: Any, shared: bool = False) -> Any:
+    """Folds node with visitor's method for each op, like a Lark Transformer.
+
+    Unless shared, each appearance of a subtree is evaluated separately, so
+    each rolls its own dice.
+    """
+    return fold(node, lambda n, a, b: getattr(visitor, n.op)(a, b), shared)
+
+
+def _digest_node(node: Node, left: Any, right: Any) -> bytes:
+    # Operands are ints, None or the digests of nodes, which repr apart
+    return hashlib.blake2b(repr((node.op, left, right)).encode(),
+                           digest_size=16).digest()
+
+
+def digest(node: Any) -> str:
+    """Returns a hash of node's content, the same in every process."""
+    value = fold(node, _digest_node, shared=True)
+    if not isinstance(value, bytes):
+        # A constant, with no nodes to hash
+        value = hashlib.blake2b(repr(value).encode(), digest_size=16).digest()
+    return value.hex()
+
+
+def _rebuild(node: Node, left: Any, right: Any) -> Node:
+    """Returns node with new operands, or node itself if they didn't change."""
+    if left is node.left and right is node.right:
+        return node
+    return Node(node.op, left, right)
+
+
+def _lower_token(token: Token) -> Any:
+    if token.type == "INT":
+        return int(token)
+    if token.type == "NAMED_DICE":
+        return NAMED_DICE[token]
+    if token.type == "WEAPON":
+        return Node(WEAPON, str(token))
+    if token.type == "SPELL_NAME":
+        return str(token)
+    raise ValueError(f"Can't lower {token.type} tokens")
+
+
+def _lower(data: str, children: List[Any]) -> Any:
+    if data in _WRAPPERS and len(children) == 1:
+        return children[0]
+    if data in _BINARY:
+        return Node(data, *children)
+    if data in _UNARY:
+        return Node(data, children[0])
+    if data == "roll_one":
+        return Node(ROLL_N, 1, children[0])
+    if data == "spell_default":
+        return Node(SPELL, children[0])
+    if data == "spell":
+        return Node(SPELL, children[0], children[1])
+    if data == "spell_reversed":
+        return Node(SPELL, children[1], children[0])
+    raise ValueError(f"Can't lower {data} nodes")
+
+
+def from_tree(tree: Any) -> Any:
+    """Lowers a parse tree, or a Lark tree of the same rules, to Nodes."""
+    values = []
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if t is _COMBINE:
+            t = stack.pop()
+            count = len(t.children)
+            children = values[len(values) - count:]
+            del values[len(values) - count:]
+            values.append(_lower(t.data, children))
+        elif isinstance(t, Tree):
+            stack.append(t)
+            stack.append(_COMBINE)
+            stack.extend(reversed(t.children))
+        elif isinstance(t, Token):
+            values.append(_lower_token(t))
+        else:
+            values.append(t)
+    return values[0]
+
+
+def resolve_names(node: Any, resolve: Callable[[Node], Any]) -> Any:
+    """Replaces each WEAPON and SPELL node with resolve(node)."""
+    def combine(n, left, right):
+        if n.op in (WEAPON, SPELL):
+            return resolve(n)
+        return _rebuild(n, left, right)
+    return fold(node, combine, shared=True)
+
+
+def _is_dice(value: Any, sides: Any = None) -> bool:
+    """Whether value is a fixed number of dice, with sides sides if given."""
+    return (isinstance(value, Node) and value.op == ROLL_N and
+            isinstance(value.left, int) and isinstance(value.right, int) and
+            (sides is None or value.right == sides))
+
+
+def simplify(node: Any) -> Any:
+    """Merges sums of the same fixed dice, e.g. 1d6 + 2d6 into 3d6."""
+    def combine(n, left, right):
+        if n.op == ADD and _is_dice(left) and _is_dice(right, left.right):
+            return Node(ROLL_N, left.left + right.left, left.right)
+        return _rebuild(n, left, right)
+    return fold(node, combine, shared=True)
+
+
+def _double_dice(node: Any) -> Any:
+    def combine(n, left, right):
+        if n.op == ROLL_N:
+            count = left * 2 if isinstance(left, int) else Node(MUL, left, 2)
+            return Node(ROLL_N, count, right)
+        return _rebuild(n, left, right)
+    return fold(node, combine, shared=True)
+
+
+def _roll_twice(node: Any, op: str) -> Any:
+    def combine(n, left, right):
+        n = _rebuild(n, left, right)
+        if n.op == ROLL_N:
+            # Both sides share the dice node, but evaluating it rolls anew
+            return Node(op, n, n)
+        return n
+    return fold(node, combine, shared=True)
+
+
+def apply_crit(node: Any) -> Any:
+    """Doubles the dice under critical, and rolls advantage dice twice.
+
+    The result has only roll_n, add, sub, mul, max and min nodes.
+    """
+    def combine(n, left, right):
+        if n.op == CRITICAL:
+            return _double_dice(left)
+        if n.op == ADVANTAGE:
+            return _roll_twice(left, MAX)
+        if n.op == DISADVANTAGE:
+            return _roll_twice(left, MIN)
+        return _rebuild(n, left, right)
+    return fold(node, combine, shared=True)
+
+
+def scale(node: Any, factor: int) -> Any:
+    """Returns a simplified node for the sum of factor rolls of node.
+
+    This recurses, but is only used on the damage dice in the knowledge
+    store, which are all shallow.
+    """
+    if isinstance(node, int):
+        return node * factor
+    if _is_dice(node):
+        return Node(ROLL_N, node.left * factor, node.right)
+    if node.op in (ADD, SUB):
+        return Node(node.op, scale(node.left, factor),
+                    scale(node.right, factor))
+    # No closed form, so fall back to adding it up
+    scaled = node
+    for _ in range(factor - 1):
+        scaled = Node(ADD, scaled, node)
+    return scaled
+
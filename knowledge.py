@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+from absl import logging
+from lark.exceptions import LarkError
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional, TypeVar
+
+from ir import from_tree, scale, simplify, Node, ADD, WEAPON
+from knowledge_store import (
+    find_spell, find_weapon, spells, weapons, Spell, Weapon)
+from parser import parse
+from util import pprint
+from exceptions import ImpossibleSpellError, RecognitionError
+
+# Way past the 9th level slots the rules have, but it stops silly requests
+# from upcasting into millions of dice.
+MAX_SPELL_LEVEL = 100
+
+T = TypeVar("T")
+
+
+class DamageDice(NamedTuple):
+    """Damage dice lowered to ir Nodes, or why there aren't any."""
+    dice_spec: Optional[str]
+    ir: Any
+    error: Optional[str]
+
+    def get(self) -> Any:
+        if self.error is not None:
+            raise ImpossibleSpellError(self.error)
+        return self.ir
+
+
+class SpellDamage(NamedTuple):
+    base: DamageDice
+    per_level: DamageDice
+
+
+class DamageTable(NamedTuple):
+    # Keyed by the names in the knowledge store
+    spells: Dict[str, SpellDamage]
+    weapons: Dict[str, DamageDice]
+
+
+def _spell_dice(spell: Spell, field: str, dice_spec: Optional[str],
+                missing_error: str) -> DamageDice:
+    if dice_spec is None:
+        return DamageDice(None, None, missing_error % spell.name)
+    try:
+        tree = parse(dice_spec, start="sum")
+    except LarkError:
+        logging.exception("Couldn't parse %s dice %r of %s",
+                          field, dice_spec, spell.name)
+        return DamageDice(dice_spec, None, missing_error % spell.name)
+    logging.debug("spell %s has %s damage dice %s parsed as:\n%s",
+                  spell.name, field, dice_spec, pprint(tree))
+    return DamageDice(dice_spec, simplify(from_tree(tree)), None)
+
+
+def spell_damage(spell: Spell) -> SpellDamage:
+    return SpellDamage(
+        _spell_dice(spell, "desc", spell.damage,
+                    "Sorry, I couldn't find the damage dice for %s"),
+        _spell_dice(spell, "higher_level", spell.higher_level_damage,
+                    "Sorry, I could't determine the additional damage dice "
+                    "for %s"))
+
+
+def weapon_damage(weapon: Weapon) -> DamageDice:
+    tree = parse(weapon.damage_dice, start="sum")
+    logging.debug("weapon %s has damage dice %s parsed as:\n%s",
+                  weapon.name, weapon.damage_dice, pprint(tree))
+    return DamageDice(weapon.damage_dice, simplify(from_tree(tree)), None)
+
+
+def build_damage_table() -> DamageTable:
+    return DamageTable(
+        {s.name: spell_damage(s) for s in spells()},
+        {w.name: weapon_damage(w) for w in weapons()})
+
+
+_DAMAGE_TABLE = None
+_DAMAGE_TABLE_LOCK = threading.Lock()
+
+
+def initialize_damage_table():
+    global _DAMAGE_TABLE
+    with _DAMAGE_TABLE_LOCK:
+        if _DAMAGE_TABLE is not None:
+            return
+        start = time.process_time()
+        _DAMAGE_TABLE = build_damage_table()
+        end = time.process_time()
+        logging.info("building damage table took %f seconds", end-start)
+
+
+def get_damage_table() -> DamageTable:
+    if _DAMAGE_TABLE is None:
+        initialize_damage_table()
+    return _DAMAGE_TABLE
+
+
+def find_named_object(name: str, find: Callable[[str], Optional[T]]) -> T:
+    found = find(name)
+    if found is None:
+        raise RecognitionError(f"Sorry, I don't know what {name} is")
+    return found
+
+
+def check_spell_level(spell: Spell, level: int):
+    if level < spell.level_int:
+        raise ImpossibleSpellError(
+            "Sorry, %s is level %d, so I can't cast it at level %d" %
+            (spell.name, spell.level_int, level))
+    if level > MAX_SPELL_LEVEL:
+        raise ImpossibleSpellError(
+            "Sorry, I can't cast spells above level %d" % MAX_SPELL_LEVEL)
+
+
+def named_damage(node: Node) -> Any:
+    """Returns the damage dice for an ir WEAPON or SPELL node."""
+    if node.op == WEAPON:
+        weapon = find_named_object(node.left, find_weapon)
+        return get_damage_table().weapons[weapon.name].get()
+    spell = find_named_object(node.left, find_spell)
+    damage = get_damage_table().spells[spell.name]
+    dice = damage.base.get()
+    level = node.right
+    if level is None:
+        return dice
+    check_spell_level(spell, level)
+    if level > spell.level_int:
+        dice = Node(ADD, dice, scale(damage.per_level.get(),
+                                     level - spell.level_int))
+    return dice
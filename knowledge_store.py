@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""A compact, read only store of the spell and weapon fields rolls need.
+
+data/spells.json is mostly prose that is never read while serving. This keeps
+just the names, levels and damage dice in an sqlite file, which is opened
+read only and memory mapped so that every worker shares the same pages
+through the page cache rather than holding its own copy of the JSON.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.request import pathname2url
+
+from absl import logging
+
+KNOWLEDGE_STORE = os.environ.get("KNOWLEDGE_STORE", "data/knowledge.sqlite")
+SPELLS_JSON = "data/spells.json"
+WEAPONS_JSON = "data/weapons.json"
+# Bump whenever the schema or the way it is filled in changes
+STORE_VERSION = 1
+# Comfortably more than the whole store
+MMAP_SIZE = 16 * 1024 * 1024
+
+SPELL_DICE_RE = re.compile(r"\d+d\d+( \+ \d+)?")
+SPELL_HIGHER_LEVEL_DICE_RE = re.compile(r"\d+d\d+( + \d+)?")
+
+
+class Spell(NamedTuple):
+    name: str
+    level_int: int
+    # The first dice in the description, or None if it has none
+    damage: Optional[str]
+    # The first dice in the higher level description, or None
+    higher_level_damage: Optional[str]
+
+
+class Weapon(NamedTuple):
+    name: str
+    damage_dice: str
+
+
+_SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE spells (
+    name TEXT PRIMARY KEY,
+    level_int INTEGER NOT NULL,
+    damage TEXT,
+    higher_level_damage TEXT);
+CREATE TABLE weapons (name TEXT PRIMARY KEY, damage_dice TEXT NOT NULL);
+-- Case folded aliases of each name. The first object to claim one keeps it.
+CREATE TABLE names (
+    kind TEXT,
+    alias TEXT,
+    name TEXT NOT NULL,
+    PRIMARY KEY (kind, alias)) WITHOUT ROWID;
+'''
+
+
+def name_aliases(name: str) -> List[str]:
+    """Returns name along with the other ways people tend to write it."""
+    no_apostrophes = name.replace("'", "")
+    aliases = {
+        name,
+        no_apostrophes,
+        name.replace("'", "\u2019"),
+        " ".join(re.split(r"[/,\s]+", no_apostrophes)),
+    }
+    return sorted(aliases)
+
+
+def source_hash() -> str:
+    h = hashlib.sha256()
+    h.update(str(STORE_VERSION).encode())
+    for data_file in (SPELLS_JSON, WEAPONS_JSON):
+        with open(data_file, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _first_match(regex, text: Optional[str]) -> Optional[str]:
+    m = regex.search(text or "")
+    return m.group(0) if m else None
+
+
+def _names(kind: str, objects: Sequence[Any]) -> List[Tuple[str, str, str]]:
+    return [(kind, alias.casefold(), o["name"])
+            for o in objects for alias in name_aliases(o["name"])]
+
+
+def populate(conn: sqlite3.Connection, spells: Sequence[Any],
+             weapons: Sequence[Any]):
+    """Creates the store's tables in conn and fills them in."""
+    conn.executescript(_SCHEMA)
+    conn.executemany("INSERT INTO spells VALUES (?, ?, ?, ?)", (
+        (s["name"], s["level_int"],
+         _first_match(SPELL_DICE_RE, s.get("desc")),
+         _first_match(SPELL_HIGHER_LEVEL_DICE_RE, s.get("higher_level")))
+        for s in spells))
+    # Some weapons, like the net, have a damage_dice of 0 rather than "0"
+    conn.executemany("INSERT INTO weapons VALUES (?, ?)", (
+        (w["name"], str(w["damage_dice"])) for w in weapons))
+    conn.executemany("INSERT OR IGNORE INTO names VALUES (?, ?, ?)",
+                     _names("spell", spells) + _names("weapon", weapons))
+    conn.execute("INSERT INTO meta VALUES ('source_hash', ?)",
+                 (source_hash(),))
+
+
+def _populate_from_json(conn: sqlite3.Connection):
+    with open(SPELLS_JSON) as spells, open(WEAPONS_JSON) as weapons:
+        with conn:
+            populate(conn, json.load(spells), json.load(weapons))
+
+
+def build_store(path: str = KNOWLEDGE_STORE):
+    # Built beside path and renamed over it, so readers never see half a store
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        _populate_from_json(conn)
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def open_store(path: str = KNOWLEDGE_STORE) -> Optional[sqlite3.Connection]:
+    """Opens the store at path, or returns None if it is missing or stale."""
+    if not os.path.exists(path):
+        return None
+    uri = "file:%s?mode=ro&immutable=1" % pathname2url(os.path.abspath(path))
+    try:
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'source_hash'").fetchone()
+    except sqlite3.Error:
+        logging.exception("Failed to open knowledge store %s", path)
+        return None
+    if row is None or row[0] != source_hash():
+        logging.info("knowledge store %s is stale, ignoring it", path)
+        conn.close()
+        return None
+    conn.execute("PRAGMA mmap_size = %d" % MMAP_SIZE)
+    return conn
+
+
+_STORE = None
+# sqlite connections may be shared between threads, but not used by two at
+# once.
+_STORE_LOCK = threading.Lock()
+
+
+def _get_store() -> sqlite3.Connection:
+    global _STORE
+    if _STORE is None:
+        start = time.process_time()
+        _STORE = open_store()
+        end = time.process_time()
+        if _STORE is not None:
+            logging.info("opening knowledge store took %f seconds", end-start)
+            return _STORE
+        # Not as compact, nor shared between workers, but still works
+        start = time.process_time()
+        _STORE = sqlite3.connect(":memory:", check_same_thread=False)
+        _populate_from_json(_STORE)
+        end = time.process_time()
+        logging.info("building in memory knowledge store took %f seconds",
+                     end-start)
+    return _STORE
+
+
+def _query(sql: str, args: Tuple = ()) -> List[Tuple]:
+    with _STORE_LOCK:
+        return _get_store().execute(sql, args).fetchall()
+
+
+# (kind, case folded alias) to the Spell or Weapon it names. Names are looked
+# up on every roll, so these are kept in a dict, read without the lock, rather
+# than queried for each time.
+_NAMES = None
+
+
+def _load_names(conn: sqlite3.Connection) -> Dict[Tuple[str, str], Any]:
+    names = {}
+    for alias, *fields in conn.execute(
+            "SELECT alias, s.name, s.level_int, s.damage, "
+            "s.higher_level_damage "
+            "FROM names JOIN spells AS s ON s.name = names.name "
+            "WHERE kind = 'spell'"):
+        names["spell", alias] = Spell(*fields)
+    for alias, *fields in conn.execute(
+            "SELECT alias, w.name, w.damage_dice "
+            "FROM names JOIN weapons AS w ON w.name = names.name "
+            "WHERE kind = 'weapon'"):
+        names["weapon", alias] = Weapon(*fields)
+    return names
+
+
+def _name_index() -> Dict[Tuple[str, str], Any]:
+    global _NAMES
+    if _NAMES is None:
+        with _STORE_LOCK:
+            if _NAMES is None:
+                _NAMES = _load_names(_get_store())
+    return _NAMES
+
+
+def _forget_store():
+    # sqlite connections mustn't be carried across a fork, so each child
+    # opens its own. The lock may have been held by a thread that didn't
+    # survive. The name index is only Python objects, so children keep it.
+    global _STORE, _STORE_LOCK
+    _STORE = None
+    _STORE_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_store)
+
+
+def spells() -> List[Spell]:
+    return [Spell(*row) for row in _query(
+        "SELECT name, level_int, damage, higher_level_damage FROM spells "
+        "ORDER BY rowid")]
+
+
+def weapons() -> List[Weapon]:
+    return [Weapon(*row) for row in _query(
+        "SELECT name, damage_dice FROM weapons ORDER BY rowid")]
+
+
+def find_spell(name: str) -> Optional[Spell]:
+    """Looks up a spell by any of its aliases, ignoring case."""
+    return _name_index().get(("spell", name.casefold()))
+
+
+def find_weapon(name: str) -> Optional[Weapon]:
+    """Looks up a weapon by any of its aliases, ignoring case."""
+    return _name_index().get(("weapon", name.casefold()))
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else KNOWLEDGE_STORE
+    start = time.process_time()
+    build_store(path)
+    end = time.process_time()
+    print("built knowledge store %s (%d bytes) in %f seconds" % (
+        path, os.path.getsize(path), end-start))
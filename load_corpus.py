@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""The weighted mix of requests that load tests replay.
+
+Shared by locustfile.py and load_test.py so that both send the same traffic.
+"""
+
+import random
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+class LoadRequest(NamedTuple):
+    # Relative frequency within the mix
+    weight: int
+    # Identifies the request in reports
+    name: str
+    path: str
+    payload: Dict[str, Any]
+
+
+def webhook_payload(dice_spec: str) -> Dict[str, Any]:
+    """A Dialogflow webhook request asking to roll dice_spec."""
+    return {
+        "session": "projects/load-test/agent/sessions/load-test",
+        "queryResult": {
+            "action": "roll",
+            "queryText": f"Roll {dice_spec}",
+            "parameters": {
+                "dice_spec": dice_spec
+            }
+        }
+    }
+
+
+def _webhook(weight: int, name: str, dice_spec: str) -> LoadRequest:
+    return LoadRequest(weight, name, "/v1", webhook_payload(dice_spec))
+
+
+CORPUS: List[LoadRequest] = [
+    _webhook(30, "plain dice", "3d20 + 5"),
+    _webhook(15, "advantage", "1d20 with advantage + 4"),
+    _webhook(15, "weapon", "longsword + 3"),
+    _webhook(10, "critical", "critical hit with a greataxe"),
+    _webhook(10, "spell", "fireball at level 5"),
+    _webhook(5, "mixed", "3d20 + fireball at level 11 + 3d(longsword)"),
+    _webhook(3, "big upcast", "fireball at level 100"),
+    _webhook(3, "big upcast critical", "critical meteor swarm at level 100"),
+    _webhook(4, "unparsable", "please roll the purple dice"),
+    _webhook(3, "impossible spell", "fireball at level 1"),
+    _webhook(2, "impossible dice", "2d0"),
+    LoadRequest(5, "json roll", "/v1/roll", {"dice_spec": "2d6 + 3"}),
+    LoadRequest(2, "json batch", "/v1/batch", {"dice_specs": [
+        "1d20 + 5", "2d6 + 3", "fireball", "1d20 with advantage",
+        "not dice"]}),
+]
+
+
+def choose(rng: Optional[random.Random] = None) -> LoadRequest:
+    """Picks a request from CORPUS according to the weights."""
+    rng = rng or random
+    return rng.choices(CORPUS, weights=[r.weight for r in CORPUS])[0]
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Load tests the server on localhost with the request mix in load_corpus.
+
+Unless --url is given, this starts the app under gunicorn with the same
+options as the Dockerfile, on a free local port, and stops it afterwards.
+Clients send requests back to back for --duration seconds, then latency
+percentiles and throughput are reported for each route and request.
+
+Nothing here talks to the cloud, so runs can be compared between builds.
+Exits with status 1 if any request failed outright, meaning a connection
+error or an HTTP 5xx.
+"""
+
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence
+from urllib.parse import urlsplit
+
+from absl import app as absl_app
+from absl import flags
+from absl import logging
+
+from load_corpus import choose
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("url", None, "Load test this server rather than "
+                    "starting one, e.g. http://localhost:8080.")
+flags.DEFINE_integer("workers", 3, "gunicorn workers to start.")
+flags.DEFINE_integer("threads", 8, "gunicorn threads per worker.")
+flags.DEFINE_integer("concurrency", 24, "Clients sending requests at once.")
+flags.DEFINE_float("duration", 30, "Seconds to send requests for.")
+flags.DEFINE_float("warmup", 3, "Seconds of requests to send, and ignore, "
+                   "before measuring.")
+flags.DEFINE_integer("seed", None, "Seed for choosing requests.")
+flags.DEFINE_string("json_output", None,
+                    "Also write the results as JSON to this file.")
+
+STARTUP_TIMEOUT = 60
+
+
+class Sample(NamedTuple):
+    path: str
+    name: str
+    status: int
+    seconds: float
+
+
+def gunicorn_command(port: int) -> List[str]:
+    """The Dockerfile's CMD, bound to localhost."""
+    return [sys.executable, "-m", "gunicorn.app.wsgiapp",
+            "--bind", "127.0.0.1:%d" % port,
+            "--workers", str(FLAGS.workers),
+            "--threads", str(FLAGS.threads),
+            "app:app"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_serving(host: str, port: int, server: subprocess.Popen):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("server exited with status %d" %
+                               server.returncode)
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request("GET", "/ready")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("server didn't start within %d seconds" %
+                       STARTUP_TIMEOUT)
+
+
+def client(host: str, port: int, until: float, rng: random.Random,
+           samples: List[Sample]):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    headers = {"Content-Type": "application/json"}
+    while time.monotonic() < until:
+        request = choose(rng)
+        body = json.dumps(request.payload)
+        start = time.perf_counter()
+        try:
+            conn.request("POST", request.path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            logging.exception("%s failed", request.name)
+            conn.close()
+            status = 0
+        samples.append(Sample(request.path, request.name, status,
+                              time.perf_counter() - start))
+
+
+def send_load(host: str, port: int, seconds: float,
+              seed: Optional[int]) -> List[Sample]:
+    """Sends requests from FLAGS.concurrency clients for seconds."""
+    seeds = random.Random(seed)
+    until = time.monotonic() + seconds
+    # list.append is atomic, so the clients can share one
+    samples = []
+    threads = [threading.Thread(target=client, args=(
+        host, port, until, random.Random(seeds.random()), samples))
+        for _ in range(FLAGS.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(fraction * len(sorted_values)))]
+
+
+def summarize(samples: Sequence[Sample], seconds: float) -> Dict[str, float]:
+    latencies = sorted(s.seconds for s in samples)
+    return {
+        "requests": len(samples),
+        "requests_per_second": len(samples) / seconds,
+        "failures": sum(1 for s in samples if s.status == 0 or
+                        s.status >= 500),
+        "client_errors": sum(1 for s in samples if 400 <= s.status < 500),
+        "p50_ms": percentile(latencies, 0.5) * 1e3,
+        "p95_ms": percentile(latencies, 0.95) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+    }
+
+
+def report(samples: Sequence[Sample], seconds: float) -> Dict[str, Dict]:
+    groups = {"all": list(samples)}
+    for s in samples:
+        groups.setdefault("route " + s.path, []).append(s)
+    for s in samples:
+        groups.setdefault(s.name, []).append(s)
+    results = {name: summarize(group, seconds)
+               for name, group in groups.items()}
+    print("%-28s %8s %9s %6s %6s %9s %9s %9s" % (
+        "", "requests", "req/s", "fail", "4xx", "p50 ms", "p95 ms", "p99 ms"))
+    for name, r in results.items():
+        print("%-28s %8d %9.1f %6d %6d %9.2f %9.2f %9.2f" % (
+            name, r["requests"], r["requests_per_second"], r["failures"],
+            r["client_errors"], r["p50_ms"], r["p95_ms"], r["p99_ms"]))
+    return results
+
+
+def main(argv):
+    del argv  # unused
+    server = None
+    if FLAGS.url:
+        url = urlsplit(FLAGS.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = "127.0.0.1", free_port()
+        command = gunicorn_command(port)
+        logging.info("starting %s", " ".join(command))
+        server = subprocess.Popen(command, env=dict(os.environ))
+    try:
+        if server is not None:
+            wait_until_serving(host, port, server)
+        if FLAGS.warmup:
+            send_load(host, port, FLAGS.warmup, FLAGS.seed)
+        samples = send_load(host, port, FLAGS.duration, FLAGS.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    results = report(samples, FLAGS.duration)
+    if FLAGS.json_output:
+        with open(FLAGS.json_output, "w") as f:
+            json.dump({"concurrency": FLAGS.concurrency,
+                       "duration": FLAGS.duration,
+                       "workers": None if FLAGS.url else FLAGS.workers,
+                       "threads": None if FLAGS.url else FLAGS.threads,
+                       "results": results}, f, indent=2)
+    if results["all"]["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    absl_app.run(main)
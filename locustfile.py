@@ -2,30 +2,19 @@
 
 import os
 
-from locust import HttpLocust, TaskSet, constant, task
+from locust import HttpUser, constant, task
 
+from load_corpus import choose
 
-URL_PATH = os.env('URL_PATH','/v1')
 
+URL_PREFIX = os.environ.get('URL_PREFIX', '')
 
-class Dice(TaskSet):
-    def roll(self, dice_spec):
-        self.locust.client.post(URL_PATH, json={
-            "queryResult": {
-                "action": "roll",
-                "queryText": f"Roll {dice_spec}",
-                "parameters": {
-                    "dice_spec": dice_spec
-                }
-            }
-        })
 
-
-    @task
-    def roll_complex(self):
-        self.roll("3d20 + fireball at level 11 + 3d(longsword)")
-
-class WebsiteUser(HttpLocust):
-    task_set = Dice
+class DiceUser(HttpUser):
     wait_time = constant(0)
 
+    @task
+    def roll(self):
+        request = choose()
+        self.client.post(URL_PREFIX + request.path, json=request.payload,
+                         name=request.name)
@@ -1,26 +1,31 @@
 #!/usr/bin/env python3
 
+import atexit
 import os
 import json
+import threading
 import logging as py_logging
 from datetime import datetime, timezone
 
 from absl import logging
 from dialogflow_v2.types import WebhookRequest, WebhookResponse, Intent
-from google.cloud import error_reporting
-import google.cloud.logging
-import google.cloud.logging.handlers
 from google.protobuf import json_format
-from typing import Sequence, Optional, TYPE_CHECKING
+from typing import (
+    Any, Dict, NamedTuple, Sequence, Optional, Tuple, TYPE_CHECKING)
 from opencensus.common.transports.async_ import AsyncTransport
+from opencensus.common.transports.sync import SyncTransport
 from opencensus.trace import (
-    tracer, samplers, execution_context, print_exporter, logging_exporter)
+    base_exporter, tracer, samplers, execution_context)
 from opencensus.trace.propagation import (
     google_cloud_format, trace_context_http_header_format)
-from opencensus.ext.stackdriver import trace_exporter
 
-from dice_calculator import roll, describe_dice
+from dice_calculator import (
+    roll, roll_batch, roll_with_plan, reroll, describe_dice, dice_payload,
+    STAGE_SECONDS)
+from error_reporter import ErrorReporter
 from exceptions import UnfulfillableRequestError
+from metrics import Counter
+from sampling import DiceResults
 
 if TYPE_CHECKING:
     import flask
@@ -31,11 +36,16 @@ TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "").lower()
 TRACE_PROPAGATE = os.environ.get("TRACE_PROPAGATE", "").lower()
 LOG_HANDLER = os.environ.get("LOG_HANDLER", "").lower()
 PROJECT_ID = os.environ.get("PROJECT_ID", "")
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "100"))
 
+# The Google Cloud and exporter backends below are only imported once the
+# environment selects them, as importing them slows down cold starts.
 
 if LOG_HANDLER == 'absl':
     logging.use_absl_handler()
 elif LOG_HANDLER == "stackdriver":
+    import google.cloud.logging
+    import google.cloud.logging.handlers
     client = google.cloud.logging.Client()
     handler = google.cloud.logging.handlers.CloudLoggingHandler(client)
     google.cloud.logging.handlers.setup_logging(handler)
@@ -65,27 +75,84 @@ if "LOG_LEVEL" in os.environ:
     logging.set_verbosity(os.environ["LOG_LEVEL"])
 
 
-def initialize_tracer(request: 'flask.Request') -> tracer.Tracer:
+class TraceConfig(NamedTuple):
+    exporter: base_exporter.Exporter
+    sampler: samplers.Sampler
+    propagator: Any
+
+
+def _build_trace_config() -> TraceConfig:
     if TRACE_PROPAGATE == "google":
         propagator = google_cloud_format.GoogleCloudFormatPropagator()
     else:
         propagator = trace_context_http_header_format.TraceContextPropagator()
     if TRACE_EXPORTER == "stackdriver":
+        from opencensus.ext.stackdriver import trace_exporter
         exporter = trace_exporter.StackdriverExporter(transport=AsyncTransport)
         sampler = samplers.AlwaysOnSampler()
     elif TRACE_EXPORTER == "log":
+        from opencensus.trace import logging_exporter
         exporter = logging_exporter.LoggingExporter(
             handler=py_logging.NullHandler(), transport=AsyncTransport)
         sampler = samplers.AlwaysOnSampler()
     elif TRACE_EXPORTER == "stdout":
+        from opencensus.trace import print_exporter
         exporter = print_exporter.PrintExporter(transport=AsyncTransport)
         sampler = samplers.AlwaysOnSampler()
     else:
-        exporter = print_exporter.PrintExporter(transport=AsyncTransport)
+        # Nothing is sampled, so don't bother with a background thread
+        from opencensus.trace import print_exporter
+        exporter = print_exporter.PrintExporter(transport=SyncTransport)
         sampler = samplers.AlwaysOffSampler()
-    span_context = propagator.from_headers(request.headers)
-    return tracer.Tracer(exporter=exporter, sampler=sampler,
-                         propagator=propagator, span_context=span_context)
+    return TraceConfig(exporter, sampler, propagator)
+
+
+_TRACE_CONFIG = None
+_TRACE_CONFIG_LOCK = threading.Lock()
+
+
+def get_trace_config() -> TraceConfig:
+    """Returns the exporter, sampler and propagator shared by the process."""
+    global _TRACE_CONFIG
+    if _TRACE_CONFIG is None:
+        with _TRACE_CONFIG_LOCK:
+            if _TRACE_CONFIG is None:
+                _TRACE_CONFIG = _build_trace_config()
+    return _TRACE_CONFIG
+
+
+def shutdown_tracing():
+    """Sends any pending traces and stops the exporter's thread."""
+    global _TRACE_CONFIG
+    with _TRACE_CONFIG_LOCK:
+        config, _TRACE_CONFIG = _TRACE_CONFIG, None
+    if config is None:
+        return
+    transport = getattr(config.exporter, "transport", None)
+    if isinstance(transport, AsyncTransport):
+        # The same hook AsyncTransport registers with atexit. It wakes the
+        # worker up rather than waiting out its wait_period.
+        transport.worker._export_pending_data()
+
+
+def _forget_trace_config():
+    # The exporter's thread doesn't survive a fork, so each child must build
+    # its own.
+    global _TRACE_CONFIG
+    _TRACE_CONFIG = None
+
+
+atexit.register(shutdown_tracing)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_trace_config)
+
+
+def initialize_tracer(request: 'flask.Request') -> tracer.Tracer:
+    config = get_trace_config()
+    span_context = config.propagator.from_headers(request.headers)
+    return tracer.Tracer(exporter=config.exporter, sampler=config.sampler,
+                         propagator=config.propagator,
+                         span_context=span_context)
 
 
 def add_fulfillment_messages(
@@ -106,10 +173,50 @@ def add_fulfillment_messages(
             fulfillment_message.suggestions.suggestions.add().title = "Re-roll"
 
 
+FOLLOWUP_CONTEXT = "roll-followup"
+
+
 def handleRoll(req: WebhookRequest, res: WebhookResponse):
     dice_spec = req.query_result.parameters["dice_spec"]
     logging.info("Requested roll: %s", dice_spec)
-    roll_result, dice_results = roll(dice_spec)
+    plan, roll_result, dice_results = roll_with_plan(dice_spec)
+    add_roll_result(req, res, dice_spec, plan.id, roll_result, dice_results)
+
+
+def followup_parameters(req: WebhookRequest) -> Dict[str, Any]:
+    """Returns the parameters handleRoll left in the follow-up context."""
+    suffix = "/contexts/" + FOLLOWUP_CONTEXT
+    for context in req.query_result.output_contexts:
+        if context.name.endswith(suffix):
+            return dict(context.parameters.items())
+    return {}
+
+
+def handleReroll(req: WebhookRequest, res: WebhookResponse):
+    """Rolls the previous roll again, optionally with a "modifier".
+
+    A modifier replaces any the previous roll had, rather than adding to it,
+    and without one the previous roll's modifier is kept.
+    """
+    previous = followup_parameters(req)
+    dice_spec = previous.get("dice_spec")
+    # Always that of the unmodified dice_spec
+    plan_id = previous.get("plan_id")
+    parameters = req.query_result.parameters
+    modifier = parameters["modifier"] if "modifier" in parameters else None
+    modifier = modifier or previous.get("modifier")
+    logging.info("Requested re-roll of %s with %s", dice_spec, modifier)
+    plan, roll_result, dice_results = reroll(plan_id, dice_spec, modifier)
+    if not modifier:
+        plan_id = plan.id
+    add_roll_result(req, res, dice_spec, plan_id, roll_result, dice_results,
+                    modifier)
+
+
+def add_roll_result(req: WebhookRequest, res: WebhookResponse,
+                    dice_spec: str, plan_id: Optional[str],
+                    roll_result: int, dice_results: DiceResults,
+                    modifier: Optional[str] = None):
     logging.info("Final result: %s", roll_result)
     dice_description = describe_dice(dice_results)
     add_fulfillment_messages(
@@ -120,10 +227,52 @@ def handleRoll(req: WebhookRequest, res: WebhookResponse):
         ["Re-roll"]
     )
     context = res.output_contexts.add()
-    context.name = req.session + "/contexts/roll-followup"
+    context.name = req.session + "/contexts/" + FOLLOWUP_CONTEXT
     context.lifespan_count = 2
     context.parameters["roll_result"] = roll_result
-    context.parameters["dice_results"] = dice_results
+    payload = dice_payload(dice_results)
+    if "dice" in payload:
+        context.parameters["dice_results"] = payload["dice"]
+    else:
+        context.parameters["dice_summary"] = payload["dice_summary"]
+    # So that a re-roll can skip parsing, falling back to dice_spec if
+    # whichever process serves it no longer has the plan. Either way the
+    # modifier is applied afresh, so the plan is the same.
+    context.parameters["dice_spec"] = dice_spec
+    if plan_id:
+        context.parameters["plan_id"] = plan_id
+    if modifier:
+        context.parameters["modifier"] = modifier
+
+
+def _error_reporting_client():
+    from google.cloud import error_reporting
+    return error_reporting.Client()
+
+
+ERROR_REPORTER = ErrorReporter(_error_reporting_client)
+atexit.register(ERROR_REPORTER.stop)
+ERROR_REPORTS = Counter(
+    "dice_error_reports_total",
+    "Error reports queued, sent, dropped for a full queue, or failed.",
+    ["outcome"])
+for _outcome in ("queued", "reported", "dropped", "failed"):
+    ERROR_REPORTS.set_function(
+        lambda o=_outcome: ERROR_REPORTER.stats()[o], _outcome)
+
+
+def report_error(request: 'flask.Request', message: Optional[str] = None):
+    """Reports the exception being handled, or message, in the background."""
+    if STACKDRIVER_ERROR_REPORTING:
+        try:
+            from google.cloud import error_reporting
+            http_context = error_reporting.build_flask_context(request)
+            if message is None:
+                ERROR_REPORTER.report_exception(http_context)
+            else:
+                ERROR_REPORTER.report(message, http_context)
+        except Exception:
+            logging.exception("Failed to queue error report")
 
 
 def handleHttp(request: 'flask.Request') -> str:
@@ -135,14 +284,65 @@ def handleHttp(request: 'flask.Request') -> str:
         if req.query_result.action == "roll":
             with tracer.span(name='roll'):
                 handleRoll(req, res)
+        elif req.query_result.action == "reroll":
+            with tracer.span(name='reroll'):
+                handleReroll(req, res)
     except UnfulfillableRequestError as e:
         logging.exception(e)
-        if STACKDRIVER_ERROR_REPORTING:
-            try:
-                client = error_reporting.Client()
-                client.report_exception(
-                    http_context=error_reporting.build_flask_context(request))
-            except Exception:
-                logging.exception("Failed to send error report to Google")
+        report_error(request)
         add_fulfillment_messages(res, str(e))
-    return json_format.MessageToJson(res)
+    with STAGE_SECONDS.labels('serialize').time():
+        return json_format.MessageToJson(res)
+
+
+def to_json(obj: Any) -> str:
+    with STAGE_SECONDS.labels('serialize').time():
+        return json.dumps(obj, separators=(",", ":"))
+
+
+def handleJsonRoll(request: 'flask.Request') -> Tuple[str, int]:
+    """Rolls {"dice_spec": ...} without going through Dialogflow's protos.
+
+    Returns the JSON response and HTTP status.
+    """
+    tracer = initialize_tracer(request)
+    body = request.get_json(force=True, silent=True)
+    dice_spec = body.get("dice_spec") if isinstance(body, dict) else None
+    if not isinstance(dice_spec, str):
+        return to_json({"error": "Expected a dice_spec string"}), 400
+    try:
+        with tracer.span(name='roll'):
+            roll_result, dice_results = roll(dice_spec)
+    except UnfulfillableRequestError as e:
+        logging.exception(e)
+        report_error(request)
+        return to_json({"dice_spec": dice_spec, "error": str(e)}), 422
+    response = {"dice_spec": dice_spec, "total": roll_result}
+    response.update(dice_payload(dice_results))
+    response["text"] = ("You rolled a total of "
+                        f"{roll_result}{describe_dice(dice_results)}")
+    return to_json(response), 200
+
+
+def handleBatch(request: 'flask.Request') -> Tuple[str, int]:
+    """Rolls every spec in {"dice_specs": [...]}.
+
+    Returns the JSON response and HTTP status.
+    """
+    tracer = initialize_tracer(request)
+    body = request.get_json(force=True, silent=True)
+    dice_specs = body.get("dice_specs") if isinstance(body, dict) else None
+    if not isinstance(dice_specs, list):
+        return to_json({"error": "Expected a list of dice_specs"}), 400
+    if len(dice_specs) > MAX_BATCH_SIZE:
+        return to_json({
+            "error": f"Sorry, I can only roll {MAX_BATCH_SIZE} at once"}), 413
+    with tracer.span(name='roll_batch'):
+        tracer.add_attribute_to_current_span("batch_size", len(dice_specs))
+        results = roll_batch(dice_specs)
+    errors = [r["error"] for r in results if "error" in r]
+    if errors:
+        # These are the user's mistakes, not ours, so aren't worth reporting
+        logging.info("Failed to roll %d of %d dice specs: %s",
+                     len(errors), len(results), "; ".join(errors))
+    return to_json({"results": results}), 200
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""In process metrics, rendered in Prometheus' text format.
+
+Each thread records counters and histograms into its own shard, so recording
+never takes a lock and threads never contend. Rendering adds the shards up,
+and may miss updates that are still in flight, which is fine for metrics.
+When a thread exits its shard is folded into a base shard, so the number of
+shards stays bounded by the number of live threads.
+"""
+
+import abc
+from bisect import bisect_left
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+import weakref
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached roll up to a huge simulation
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, value.replace("\\", r"\\").replace(
+            "\n", r"\n").replace('"', r'\"'))
+        for name, value in labels)
+
+
+class _Owner:
+    """Lives in a thread's local storage, so dies with the thread."""
+    __slots__ = ("__weakref__",)
+
+
+class _Sharded(abc.ABC):
+    """Hands each thread its own shard, made by new_shard."""
+
+    def __init__(self):
+        self._reset()
+        _SHARDED.add(self)
+
+    def _reset(self):
+        self._local = threading.local()
+        # What threads that have exited recorded
+        self._base = self.new_shard()
+        self._shards = set()
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def new_shard(self):
+        """Returns an empty shard, with a merge(other) method."""
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self.new_shard()
+            owner = self._local.owner = _Owner()
+            weakref.finalize(owner, self._retire, shard)
+            # Only taken the first time each thread records
+            with self._lock:
+                self._shards.add(shard)
+            return shard
+
+    def _retire(self, shard):
+        # The thread has exited, so nothing else will write to shard
+        with self._lock:
+            if shard in self._shards:
+                self._shards.remove(shard)
+                self._base.merge(shard)
+
+    def shards(self) -> List:
+        with self._lock:
+            return [self._base] + list(self._shards)
+
+
+# Every _Sharded, without keeping any alive
+_SHARDED = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for sharded in list(_SHARDED):
+        sharded._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    # Each worker reports only what it recorded itself, not a copy of what
+    # the parent recorded before forking.
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _CounterShard:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def merge(self, other: "_CounterShard"):
+        self.value += other.value
+
+
+class _Counter(_Sharded):
+    def new_shard(self) -> _CounterShard:
+        return _CounterShard()
+
+    def inc(self, amount: int = 1):
+        self.shard().value += amount
+
+    def value(self) -> int:
+        return sum(s.value for s in self.shards())
+
+
+class _Gauge:
+    """A value that is set rather than added to, so needs no shards."""
+
+    def __init__(self):
+        self._value = 0
+
+    def set(self, value: float):
+        self._value = value
+
+    def value(self) -> float:
+        return self._value
+
+
+class _Function:
+    """A value read from elsewhere, such as a cache's stats, when rendered."""
+
+    def __init__(self, function: Callable[[], float]):
+        self._function = function
+
+    def value(self) -> float:
+        return self._function()
+
+
+class _HistogramShard:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, buckets: int):
+        # One more than the buckets, for +Inf
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+
+    def merge(self, other: "_HistogramShard"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: "_Histogram"):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _Histogram(_Sharded):
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        super().__init__()
+
+    def new_shard(self) -> _HistogramShard:
+        return _HistogramShard(len(self.buckets))
+
+    def observe(self, value: float):
+        shard = self.shard()
+        # Buckets are inclusive upper bounds
+        shard.counts[bisect_left(self.buckets, value)] += 1
+        shard.sum += value
+
+    def time(self) -> _Timer:
+        """Returns a context manager that observes how long it was in."""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """Returns the count in each bucket, +Inf last, and their sum."""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for shard in self.shards():
+            for i, count in enumerate(shard.counts):
+                counts[i] += count
+            total += shard.sum
+        return counts, total
+
+
+class _Family(abc.ABC):
+    """A metric and its children, one for each combination of labels."""
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    @abc.abstractmethod
+    def new_child(self):
+        """Returns a new child, for a combination of labels."""
+
+    def labels(self, *values: str):
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError("%s needs labels %s, got %s" % (
+                    self.name, self.labelnames, values)) from None
+            with self._lock:
+                return self._children.setdefault(values, self.new_child())
+
+    def set_function(self, function: Callable[[], float], *values: str):
+        """Makes the child with these labels render as function()."""
+        if len(values) != len(self.labelnames):
+            raise ValueError("%s needs labels %s, got %s" % (
+                self.name, self.labelnames, values))
+        with self._lock:
+            self._children[values] = _Function(function)
+
+    def children(self) -> Dict[Tuple[str, ...], object]:
+        with self._lock:
+            return dict(self._children)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Returns the lines of samples for every child."""
+
+    def value_samples(self) -> List[str]:
+        """One sample per child, for children with a value()."""
+        return ["%s%s %s" % (
+            self.name, _format_labels(list(zip(self.labelnames, values))),
+            _format_value(child.value()))
+            for values, child in sorted(self.children().items())]
+
+    def render(self) -> str:
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.TYPE)]
+        lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Family):
+    TYPE = "counter"
+
+    def new_child(self) -> _Counter:
+        return _Counter()
+
+    def inc(self, amount: int = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return self.value_samples()
+
+
+class Gauge(_Family):
+    TYPE = "gauge"
+
+    def new_child(self) -> _Gauge:
+        return _Gauge()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self) -> List[str]:
+        return self.value_samples()
+
+
+class Histogram(_Family):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def new_child(self) -> _Histogram:
+        return _Histogram(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in sorted(self.children().items()):
+            labels = list(zip(self.labelnames, values))
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (
+                    self.name,
+                    _format_labels(labels + [("le", _format_value(bound))]),
+                    cumulative))
+            lines.append("%s_sum%s %s" % (
+                self.name, _format_labels(labels), _format_value(total)))
+            lines.append("%s_count%s %d" % (
+                self.name, _format_labels(labels), cumulative))
+        return lines
+
+
+# Every metric, in the order they were created
+REGISTRY: List[_Family] = []
+
+
+def render() -> str:
+    """Returns every metric in Prometheus' text exposition format."""
+    return "".join(family.render() for family in REGISTRY)
@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 
-import json
+import copyreg
+import hashlib
+import os
+import pickle
 import sys
+import threading
 import time
-from typing import Iterable
+from typing import Callable, Iterable, Optional, Tuple
 
 from absl import logging
-from lark import Lark
+import lark
+from lark import Lark, Tree
+from lark.exceptions import LarkError
+from lark.grammar import Rule
+from lark.lark import LarkOptions
+from lark.lexer import TerminalDef
+
+from knowledge_store import name_aliases, spells, weapons
+from metrics import Counter
 
 # Lark has recursion issues
 if sys.getrecursionlimit() < 5000:
@@ -31,10 +43,6 @@ NAMED_DICE = {
 }
 
 
-SPELLS = json.load(open("data/spells.json"))
-WEAPONS = json.load(open("data/weapons.json"))
-
-
 def list_to_lark_literal(
         literal_name: str, values: Iterable[str], case_sensitive=False) -> str:
     case_marker = "" if case_sensitive else "i"
@@ -43,7 +51,7 @@ def list_to_lark_literal(
     return spec
 
 
-GRAMMER = '''
+_GRAMMER_HEAD = '''
 start:  sum
 
 %import common.INT
@@ -78,16 +86,11 @@ critical: "critical"i "to"i? "hit"i? "with"? "a"? _damage
 _damage: WEAPON
        | spell
 
-dice: _die -> roll_one
-    | value _die -> roll_n
-
 advantage: dice "with advantage"i
          | dice "with disadvantage"i -> disadvantage
+'''
 
-_die: "d"i value
-   | value "sided"i ("dice"i|"die"i)
-   | NAMED_DICE
-
+_GRAMMER_TAIL = '''
 spell: SPELL_NAME -> spell_default
      | SPELL_NAME "at level"i INT
      | SPELL_NAME "at"? INT _ORDINAL "level"i
@@ -95,22 +98,163 @@ spell: SPELL_NAME -> spell_default
      | INT _ORDINAL "level" SPELL_NAME -> spell_reversed
 _ORDINAL: "st"i | "nd"i | "rd"i | "th"i
 '''
-GRAMMER += list_to_lark_literal("NAMED_DICE", NAMED_DICE.keys())
-GRAMMER += list_to_lark_literal("WEAPON", (w["name"] for w in WEAPONS))
-GRAMMER += list_to_lark_literal("SPELL_NAME", (s["name"] for s in SPELLS))
+_GRAMMER_TAIL += list_to_lark_literal("NAMED_DICE", NAMED_DICE.keys())
+_GRAMMER_TAIL += list_to_lark_literal(
+    "WEAPON", (a for w in weapons() for a in name_aliases(w.name)))
+_GRAMMER_TAIL += list_to_lark_literal(
+    "SPELL_NAME", (a for s in spells() for a in name_aliases(s.name)))
+
+GRAMMER = _GRAMMER_HEAD + '''
+dice: _die -> roll_one
+    | value _die -> roll_n
+
+_die: "d"i value
+   | value "sided"i ("dice"i|"die"i)
+   | NAMED_DICE
+''' + _GRAMMER_TAIL
+
+# The same language restricted so that LALR(1) can handle it: dice counts and
+# sizes must be plain numbers or parenthesised, which rules out ambiguous
+# chains like "2d6d8". Each operand position gets its own rule so that their
+# follow sets don't collide. Anything rejected here is retried with the
+# Earley parser for GRAMMER, and the trees match for everything accepted.
+LALR_GRAMMER = _GRAMMER_HEAD + '''
+dice: _die -> roll_one
+    | die_count _die -> roll_n
+
+_die: "d"i die_size
+    | sided_die_size "sided"i ("dice"i|"die"i)
+    | NAMED_DICE
+
+die_count: INT -> value
+         | "("i sum ")"i -> value
+die_size: INT -> value
+        | "("i sum ")"i -> value
+sided_die_size: INT -> value
+              | "("i sum ")"i -> value
+''' + _GRAMMER_TAIL
+
+PARSER_CACHE = os.environ.get("PARSER_CACHE", "data/parser.pickle")
 
+# LarkOptions.__getattr__ recurses forever when pickle probes a half-built
+# instance, so rebuild it from its options dict instead.
+copyreg.pickle(LarkOptions, lambda o: (LarkOptions, (dict(o.options),)))
+
+
+def grammer_hash() -> str:
+    h = hashlib.sha256()
+    h.update(lark.__version__.encode())
+    h.update(GRAMMER.encode())
+    h.update(LALR_GRAMMER.encode())
+    for data_file in ("data/spells.json", "data/weapons.json"):
+        with open(data_file, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def compile_parsers() -> Tuple[Lark, Lark]:
+    """Returns the (LALR, Earley) parser pair."""
+    return (Lark(LALR_GRAMMER, parser="lalr", lexer="contextual",
+                 start=["start", "sum"]),
+            Lark(GRAMMER))
+
+
+def save_parsers(parsers: Tuple[Lark, Lark], path: str = PARSER_CACHE):
+    fast, full = parsers
+    with open(path, "wb") as f:
+        pickle.dump(grammer_hash(), f, pickle.HIGHEST_PROTOCOL)
+        # Lark's LALR tables don't survive pickling, but it has its own
+        # serialization for them. The Earley parser has no such support.
+        pickle.dump(fast.memo_serialize([TerminalDef, Rule]), f,
+                    pickle.HIGHEST_PROTOCOL)
+        pickle.dump(full, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_parsers(path: str = PARSER_CACHE) -> Optional[Tuple[Lark, Lark]]:
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) != grammer_hash():
+                logging.info("cached parser %s is stale, ignoring it", path)
+                return None
+            data, memo = pickle.load(f)
+            fast = Lark.deserialize(
+                data, {"Rule": Rule, "TerminalDef": TerminalDef}, memo)
+            return fast, pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.exception("Failed to load cached parser from %s", path)
+        return None
+
+
+_FAST_PARSER = None
 _PARSER = None
+_PARSER_LOCK = threading.Lock()
+PARSES = Counter("dice_parses_total",
+                  "Parses the LALR parser handled, and those that had to "
+                  "fall back to Earley.", ["parser"])
+# So that both show up, even at 0
+PARSES.labels("lalr")
+PARSES.labels("earley_fallback")
 
 
 def initialize_parser():
-    global _PARSER
-    start = time.process_time()
-    _PARSER = Lark(GRAMMER)
-    end = time.process_time()
-    logging.info("compiling grammer took %f seconds", end-start)
+    global _FAST_PARSER, _PARSER
+    # Without the lock, warming up and the first requests would each load
+    # or compile the parsers at once
+    with _PARSER_LOCK:
+        if _FAST_PARSER is not None and _PARSER is not None:
+            return
+        start = time.process_time()
+        parsers = load_parsers()
+        end = time.process_time()
+        if parsers is not None:
+            _FAST_PARSER, _PARSER = parsers
+            logging.info("loading cached parser took %f seconds", end-start)
+            return
+        logging.info("checking for cached parser took %f seconds", end-start)
+        start = time.process_time()
+        _FAST_PARSER, _PARSER = compile_parsers()
+        end = time.process_time()
+        logging.info("compiling grammer took %f seconds", end-start)
 
 
 def get_parser() -> Lark:
+    """Returns the Earley parser, which accepts the full GRAMMER."""
     if _PARSER is None:
         initialize_parser()
     return _PARSER
+
+
+def get_fast_parser() -> Lark:
+    """Returns the LALR parser, which accepts LALR_GRAMMER."""
+    if _FAST_PARSER is None:
+        initialize_parser()
+    return _FAST_PARSER
+
+
+def parse(text: str, start: str = "start",
+          before_fallback: Optional[Callable[[str], None]] = None) -> Tree:
+    """Parses text with the LALR parser, or failing that the Earley parser.
+
+    before_fallback is called with text before falling back, and may raise
+    to refuse text that would be too slow to parse.
+    """
+    try:
+        tree = get_fast_parser().parse(text, start=start)
+    except LarkError:
+        if before_fallback is not None:
+            before_fallback(text)
+        PARSES.labels("earley_fallback").inc()
+        logging.debug("LALR parser rejected %r, falling back to Earley", text)
+        return get_parser().parse(text, start=start)
+    PARSES.labels("lalr").inc()
+    return tree
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else PARSER_CACHE
+    start = time.process_time()
+    save_parsers(compile_parsers(), path)
+    end = time.process_time()
+    print("compiled and saved parsers in %f seconds" % (end-start))
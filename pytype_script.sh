@@ -1,2 +1,2 @@
 #!/bin/sh
-PATH="$PATH:$HOME/.local/bin" python3 -m pytype main.py util.py transformers.py parser.py exceptions.py dice_calculator.py
+PATH="$PATH:$HOME/.local/bin" python3 -m pytype main.py util.py transformers.py parser.py exceptions.py dice_calculator.py cache.py compiler.py knowledge.py knowledge_store.py sampling.py distribution.py simulation.py error_reporter.py metrics.py load_corpus.py warmup.py cost.py ir.py
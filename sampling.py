@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+from array import array
+import heapq
+import itertools
+import os
+import random
+from typing import Any, Iterator, List, Sequence, Tuple
+
+from exceptions import ImpossibleDiceError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The largest die an array('q') or numpy.int64 can hold
+_MAX_TYPED_SIDES = 2**63 - 1
+# random.choices picks with floor(random() * n), which is only uniform while
+# n fits in a double's 53 bit mantissa
+_MAX_CHOICES_SIDES = 2**53
+
+_NUMPY_RNG = numpy.random.default_rng() if numpy is not None else None
+
+
+def _reseed_after_fork():
+    global _NUMPY_RNG
+    _NUMPY_RNG = numpy.random.default_rng()
+
+
+if numpy is not None and hasattr(os, "register_at_fork"):
+    # Otherwise every forked gunicorn worker would roll the same dice
+    os.register_at_fork(after_in_child=_reseed_after_fork)
+
+
+def default_rng() -> Any:
+    """Returns a numpy Generator if numpy is installed, else random."""
+    return _NUMPY_RNG if _NUMPY_RNG is not None else random
+
+
+def check_dice(count: int, sides: int):
+    """Raises ImpossibleDiceError unless count dice of sides can be rolled."""
+    if count <= 0:
+        raise ImpossibleDiceError(
+            f"Sorry, I couldn't roll {count} dice.")
+    if sides <= 0:
+        raise ImpossibleDiceError(
+            f"Sorry, I couldn't roll a {sides} sided die.")
+
+
+def roll_dice(count: int, sides: int, rng: Any = None) -> Sequence[int]:
+    """Rolls count dice with the given number of sides in a single call.
+
+    rng is either a numpy Generator, which returns a numpy array, or
+    something with the interface of the random module, which returns an
+    array('q'). Dice too big for 64 bits come back in a list.
+    """
+    if rng is None:
+        rng = default_rng()
+    if numpy is not None and isinstance(rng, numpy.random.Generator):
+        if sides <= _MAX_TYPED_SIDES:
+            return rng.integers(1, sides, endpoint=True, size=count,
+                                dtype=numpy.int64)
+        rng = random
+    if sides > _MAX_TYPED_SIDES:
+        return [rng.randint(1, sides) for _ in range(count)]
+    if sides > _MAX_CHOICES_SIDES:
+        return array('q', [rng.randint(1, sides) for _ in range(count)])
+    return array('q', rng.choices(range(1, sides + 1), k=count))
+
+
+def dice_total(rolls: Sequence[int]) -> int:
+    if numpy is not None and isinstance(rolls, numpy.ndarray):
+        if len(rolls) * int(rolls.max(initial=0)) <= _MAX_TYPED_SIDES:
+            return int(rolls.sum())
+        return sum(rolls.tolist())
+    return sum(rolls)
+
+
+def dice_list(rolls: Sequence[int]) -> List[int]:
+    """Converts the result of roll_dice to a list of python ints."""
+    if isinstance(rolls, list):
+        return rolls
+    return rolls.tolist()
+
+
+class DiceResults:
+    """Every die a roll drew, in order, kept as roll_dice returned them.
+
+    Turning each die into a python int is most of the cost of a big roll,
+    so that is only done for the dice that are asked for.
+    """
+    __slots__ = ("_rolls", "_count")
+
+    def __init__(self):
+        self._rolls = []
+        self._count = 0
+
+    def extend(self, rolls: Sequence[int]):
+        self._rolls.append(rolls)
+        self._count += len(rolls)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        for rolls in self._rolls:
+            yield from dice_list(rolls)
+
+    def tolist(self) -> List[int]:
+        dice = []
+        for rolls in self._rolls:
+            dice.extend(dice_list(rolls))
+        return dice
+
+    def extremes(self, n: int) -> Tuple[List[int], List[int]]:
+        """Returns the highest n dice, highest first, and the lowest n."""
+        highest, lowest = [], []
+        for rolls in self._rolls:
+            if numpy is not None and isinstance(rolls, numpy.ndarray):
+                if len(rolls) > 2 * n:
+                    # Only the dice that could be among the extremes
+                    rolls = numpy.concatenate([
+                        numpy.partition(rolls, n - 1)[:n],
+                        numpy.partition(rolls, len(rolls) - n)[-n:]])
+                rolls = rolls.tolist()
+            highest = heapq.nlargest(n, itertools.chain(highest, rolls))
+            lowest = heapq.nsmallest(n, itertools.chain(lowest, rolls))
+        return highest, lowest
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, DiceResults):
+            return self.tolist() == other.tolist()
+        if isinstance(other, (list, tuple)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return "DiceResults(%r)" % self.tolist()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Monte Carlo simulation of resolved dice ir.
+
+Needs numpy, which sampling.py can do without.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy
+
+from distribution import Distribution
+from exceptions import IncalculableOddsError
+from ir import evaluate
+from sampling import check_dice
+
+# Trials evaluated together. Bigger batches amortize more overhead but use
+# more memory.
+BATCH_TRIALS = 1 << 16
+# Most dice to hold in memory at once while rolling a batch
+BATCH_DICE = 1 << 22
+# Totals are summed in int64
+_MAX_TOTAL = 2**63 - 1
+
+_Values = Union[int, numpy.ndarray]
+# (values, counts): counts[i] trials came out as values[i], in value order.
+# Kept sparse, as results can be spread far wider than there are trials.
+_Histogram = Tuple[numpy.ndarray, numpy.ndarray]
+
+
+class Simulation(NamedTuple):
+    trials: int
+    values: numpy.ndarray
+    counts: numpy.ndarray
+    seconds: float
+
+    def histogram(self) -> Dict[int, int]:
+        return dict(zip(self.values.tolist(), self.counts.tolist()))
+
+    def distribution(self) -> Distribution:
+        return Distribution.from_counts(self.values, self.counts)
+
+    @property
+    def trials_per_second(self) -> float:
+        return self.trials / self.seconds if self.seconds else float("inf")
+
+    def summary(self) -> Dict[str, Union[int, float]]:
+        """Like Distribution.summary, worked out on the sparse histogram."""
+        summary = {}
+        if self.trials:
+            p = self.counts / self.trials
+            mean = float(numpy.dot(self.values, p))
+            deviation = self.values - mean
+            summary.update(min=int(self.values[0]),
+                           max=int(self.values[-1]), mean=mean,
+                           variance=float(numpy.dot(deviation * deviation, p)))
+            cdf = numpy.cumsum(p)
+            for q in (5, 25, 50, 75, 95):
+                i = numpy.searchsorted(cdf, q / 100 - 1e-9)
+                summary[f"p{q}"] = int(self.values[min(i, len(p) - 1)])
+        summary["trials"] = self.trials
+        summary["trials_per_second"] = self.trials_per_second
+        return summary
+
+
+def _magnitude(values: _Values) -> int:
+    if isinstance(values, numpy.ndarray):
+        return int(numpy.abs(values).max(initial=0))
+    return abs(values)
+
+
+def _check_total(bound: int):
+    # Past this int64 arithmetic would silently wrap around
+    if bound > _MAX_TOTAL:
+        raise IncalculableOddsError(
+            "Sorry, those dice are too big for me to simulate")
+
+
+class EvalTrials:
+    """Like EvalDice, but evaluates the ir for many trials at once.
+
+    Each node evaluates to an int if it is the same in every trial, else to
+    an array holding its value in each trial.
+    """
+
+    def __init__(self, trials: int, rng: numpy.random.Generator):
+        self.trials = trials
+        self.rng = rng
+
+    def roll_n(self, count, sides):
+        check_dice(int(numpy.min(count)), int(numpy.min(sides)))
+        _check_total(int(numpy.max(count)) * int(numpy.max(sides)))
+        if isinstance(sides, numpy.ndarray):
+            sides = sides[:, None]
+        totals = numpy.zeros(self.trials, dtype=numpy.int64)
+        most = int(numpy.max(count))
+        columns = max(1, BATCH_DICE // self.trials)
+        # Roll a block of dice for every trial at a time, ignoring the
+        # dice past the count of trials that roll fewer.
+        for first in range(0, most, columns):
+            width = min(columns, most - first)
+            rolls = self.rng.integers(1, sides, endpoint=True,
+                                      size=(self.trials, width))
+            if isinstance(count, numpy.ndarray):
+                rolls *= (first + numpy.arange(width)) < count[:, None]
+            totals += rolls.sum(axis=1)
+        return totals
+
+    def add(self, a, b):
+        _check_total(_magnitude(a) + _magnitude(b))
+        return a + b
+
+    def sub(self, a, b):
+        _check_total(_magnitude(a) + _magnitude(b))
+        return a - b
+
+    def mul(self, a, b):
+        _check_total(_magnitude(a) * _magnitude(b))
+        return a * b
+
+    def max(self, a, b):
+        return numpy.maximum(a, b)
+
+    def min(self, a, b):
+        return numpy.minimum(a, b)
+
+
+def _count(results: numpy.ndarray) -> _Histogram:
+    lowest = int(results.min())
+    if int(results.max()) - lowest < 4 * len(results):
+        # Close enough together to count densely, which is quicker
+        counts = numpy.bincount(results - lowest)
+        values = numpy.flatnonzero(counts)
+        return values + lowest, counts[values]
+    return numpy.unique(results, return_counts=True)
+
+
+def _merge(histograms: List[_Histogram]) -> _Histogram:
+    if not histograms:
+        return (numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros(0, dtype=numpy.int64))
+    values, index = numpy.unique(numpy.concatenate([h[0] for h in histograms]),
+                                 return_inverse=True)
+    counts = numpy.zeros(len(values), dtype=numpy.int64)
+    numpy.add.at(counts, index, numpy.concatenate([h[1] for h in histograms]))
+    return values, counts
+
+
+def simulate_tree(node: Any, trials: int,
+                  rng: Optional[numpy.random.Generator] = None
+                  ) -> _Histogram:
+    """Returns the (values, counts) histogram of trials rolls of ir node."""
+    if rng is None:
+        rng = numpy.random.default_rng()
+    histograms = []
+    for first in range(0, trials, BATCH_TRIALS):
+        batch = min(BATCH_TRIALS, trials - first)
+        results = evaluate(node, EvalTrials(batch, rng))
+        histograms.append(_count(numpy.broadcast_to(results, (batch,))))
+    return _merge(histograms)
+
+
+def _simulate_spec(dice_spec: str, trials: int,
+                   seed: numpy.random.SeedSequence
+                   ) -> _Histogram:
+    from dice_calculator import resolve
+    return simulate_tree(resolve(dice_spec).ir, trials,
+                         numpy.random.default_rng(seed))
+
+
+def simulate(dice_spec: str, trials: int, processes: int = 1,
+             seed: Optional[int] = None) -> Simulation:
+    """Rolls dice_spec trials times, optionally over a pool of processes."""
+    start = time.perf_counter()
+    seeds = numpy.random.SeedSequence(seed).spawn(processes)
+    if processes <= 1:
+        histogram = _simulate_spec(dice_spec, trials, seeds[0])
+    else:
+        parts = [trials // processes + (i < trials % processes)
+                 for i in range(processes)]
+        with ProcessPoolExecutor(processes) as pool:
+            histogram = _merge(list(pool.map(
+                _simulate_spec, [dice_spec] * processes, parts, seeds)))
+    seconds = time.perf_counter() - start
+    return Simulation(trials, histogram[0], histogram[1], seconds)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+from absl.testing import absltest
+
+from cache import LRUCache
+
+
+class LRUCacheTest(absltest.TestCase):
+    def test_miss(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_hit(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLen(cache, 2)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.clear()
+        self.assertEqual(cache.stats(), {
+            "size": 0, "maxsize": 2, "hits": 0, "misses": 0, "evictions": 0})
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import random
+
+from absl.testing import absltest
+
+from compiler import compile_tree, _compile
+from dice_calculator import resolve
+from exceptions import ImpossibleDiceError
+from ir import evaluate, Node
+from transformers import EvalDice
+
+
+class CompileTreeTest(absltest.TestCase):
+    def assertMatchesEvalDice(self, node):
+        transformer = EvalDice(random.Random(1234))
+        expected = evaluate(node, transformer)
+        self.assertEqual(compile_tree(node)(random.Random(1234)),
+                         (expected, transformer.dice_results))
+
+    def test_constant(self):
+        self.assertEqual(compile_tree(3)(), (3, []))
+
+    def test_folds_constants(self):
+        node = Node("add", Node("mul", 2, 3), Node("max", 1, 4))
+        self.assertEqual(_compile(node), 10)
+
+    def test_folds_around_dice(self):
+        compiled = _compile(Node("add", Node("roll_n", 1, 1),
+                                         Node("sub", 5, 2)))
+        self.assertTrue(callable(compiled))
+        self.assertEqual(compiled(random.Random(), []), 4)
+
+    def test_matches_eval_dice(self):
+        for node in [
+            Node("roll_n", 3, 6),
+            Node("add", Node("roll_n", 3, 6), 2),
+            Node("sub", 4, Node("roll_n", 1, 20)),
+            Node("mul", Node("roll_n", 2, 4), Node("roll_n", 1, 8)),
+            Node("max", Node("roll_n", 1, 20), Node("roll_n", 1, 20)),
+            Node("min", Node("roll_n", 1, 20), Node("roll_n", 1, 20)),
+            Node("roll_n", Node("roll_n", 1, 4), Node("add", 4, 2)),
+        ]:
+            self.assertMatchesEvalDice(node)
+
+    def test_matches_eval_dice_resolved(self):
+        for spec in ["3d20 + fireball at level 5", "critical longsword",
+                     "to hit with advantage", "2d(1d4) times 3"]:
+            self.assertMatchesEvalDice(resolve(spec).ir)
+
+    def test_long_sums_dont_recurse(self):
+        node = Node("roll_n", 1, 4)
+        for i in range(20000):
+            node = Node("add" if i % 3 else "sub", node,
+                        Node("roll_n", 1, 6 + i % 2))
+        node = Node("sub", 3, Node("add", node, Node("add", 1, node)))
+        self.assertMatchesEvalDice(node)
+
+    def test_shared_nodes_roll_separately(self):
+        dice = Node("roll_n", 1, 1000)
+        self.assertMatchesEvalDice(Node("add", dice, dice))
+        _, dice_results = compile_tree(Node("add", dice, dice))()
+        self.assertLen(dice_results, 2)
+
+    def test_uses_rng(self):
+        roll = compile_tree(Node("roll_n", 5, 6))
+        self.assertEqual(roll(random.Random(7)), roll(random.Random(7)))
+
+    def test_impossible_constant_dice(self):
+        with self.assertRaises(ImpossibleDiceError):
+            compile_tree(Node("roll_n", 0, 6))
+        with self.assertRaises(ImpossibleDiceError):
+            compile_tree(Node("roll_n", 1, -6))
+
+    def test_impossible_dynamic_dice(self):
+        roll = compile_tree(Node("roll_n", Node("sub",
+                                                Node("roll_n", 1, 1), 1), 6))
+        with self.assertRaises(ImpossibleDiceError):
+            roll()
+
+    def test_unknown_node(self):
+        with self.assertRaises(ValueError):
+            compile_tree(Node("critical", 1))
+
+
+if __name__ == '__main__':
+    absltest.main()
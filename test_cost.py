@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import time
+
+from absl.testing import absltest
+from lark import Tree
+
+import cost
+from cost import check_cost, check_shape, estimate_cost, tree_shape, Cost
+from dice_calculator import resolve, roll
+from exceptions import TooExpensiveError, UnfulfillableRequestError
+from ir import Node
+from parser import parse
+
+
+def roll_n(count, sides):
+    return Node("roll_n", count, sides)
+
+
+class EstimateCostTest(absltest.TestCase):
+    def test_constant(self):
+        self.assertEqual(estimate_cost(3), Cost(0, 1, 1))
+
+    def test_dice(self):
+        self.assertEqual(estimate_cost(roll_n(3, 6)).dice, 3)
+        self.assertEqual(
+            estimate_cost(Node("add", roll_n(3, 6), roll_n(2, 4))).dice, 5)
+
+    def test_dice_count_from_dice(self):
+        # Up to 2*6 dice, plus the 2 rolled to decide how many
+        self.assertEqual(estimate_cost(roll_n(roll_n(2, 6), 8)).dice, 14)
+
+    def test_ranges(self):
+        self.assertEqual(
+            estimate_cost(roll_n(Node("mul", roll_n(1, 4), 10), 6)).dice,
+            41)
+        self.assertEqual(
+            estimate_cost(roll_n(Node("sub", 10, roll_n(1, 4)), 6)).dice,
+            10)
+        self.assertEqual(
+            estimate_cost(roll_n(Node("max", roll_n(1, 4), 2), 6)).dice, 5)
+        self.assertEqual(
+            estimate_cost(roll_n(Node("min", roll_n(1, 4), 2), 6)).dice, 3)
+
+    def test_shared_nodes_counted_each_time(self):
+        dice = roll_n(3, 6)
+        node = Node("add", Node("add", dice, dice), dice)
+        self.assertEqual(estimate_cost(node), Cost(9, 3, 11))
+
+    def test_sums_not_nested(self):
+        node = roll_n(1, 6)
+        for _ in range(1000):
+            node = Node("sub", Node("add", node, roll_n(1, 8)), 1)
+        # The sums, over a roll_n over its operands
+        self.assertEqual(estimate_cost(node).depth, 3)
+        self.assertEqual(estimate_cost(Node("mul", node, 2)).depth, 4)
+
+    def test_huge_values_saturate(self):
+        node = 10**9
+        for _ in range(50):
+            node = Node("mul", node, node)
+        self.assertLessEqual(estimate_cost(roll_n(node, 6)).dice,
+                             2**128)
+
+    def test_matches_resolved_specs(self):
+        self.assertEqual(estimate_cost(resolve("4d6 + 2").ir).dice, 4)
+        self.assertEqual(
+            estimate_cost(resolve("1d20 with advantage").ir).dice, 2)
+        self.assertEqual(
+            estimate_cost(resolve("critical hit with a longsword").ir).dice,
+            2)
+
+
+class TreeShapeTest(absltest.TestCase):
+    def test_shape(self):
+        self.assertEqual(tree_shape(Tree("add", [Tree("roll_n", [3, 6]), 1])),
+                         Cost(0, 3, 5))
+
+    def test_sums_not_nested(self):
+        cost = tree_shape(parse(" + ".join(["1d6", "1d8"] * 500)))
+        self.assertLess(cost.depth, 10)
+
+    def test_deep(self):
+        tree = 1
+        for _ in range(100000):
+            tree = Tree("value", [tree])
+        self.assertEqual(tree_shape(tree).depth, 100001)
+
+
+class AdmissionTest(absltest.TestCase):
+    def test_too_many_dice(self):
+        for spec in ("1000000000d6", "(999999d999) times (999999d999)",
+                     "3d(100000d6)"):
+            with self.assertRaisesRegex(TooExpensiveError, "(?i)sorry"):
+                roll(spec)
+
+    def test_too_deep(self):
+        with self.assertRaises(TooExpensiveError):
+            roll("(" * 1000 + "1" + ")" * 1000)
+        with self.assertRaises(TooExpensiveError):
+            roll("(" * 3000 + "1" + ")" * 3000)
+        self.assertEqual(roll("(" * 50 + "1" + ")" * 50), (1, []))
+
+    def test_too_long(self):
+        with self.assertRaises(TooExpensiveError):
+            check_shape(parse(" + ".join(["(1+1)"] * 3000)))
+        with self.assertRaisesRegex(TooExpensiveError, "too long"):
+            roll(" + ".join(["1d6"] * 5000))
+
+    def test_long_ambiguous_chain(self):
+        before = cost.REJECTIONS.labels("fallback_spec_length").value()
+        start = time.perf_counter()
+        for terms in (80, 160):
+            with self.assertRaisesRegex(TooExpensiveError, "too long"):
+                roll("d".join(["2"] * terms))
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(
+            cost.REJECTIONS.labels("fallback_spec_length").value(),
+            before + 2)
+        # Short ones still fall back
+        self.assertBetween(roll("2d2d2")[0], 1, 8)
+
+    def test_long_sums(self):
+        terms = ["1d6", "1d8"] * 500
+        total, dice = roll(" + ".join(terms))
+        self.assertLen(dice, 1000)
+        self.assertBetween(total, 1000, 7000)
+
+    def test_within_budget(self):
+        check_cost(resolve("fireball at level 100").ir)
+        total, dice = roll("%dd1" % cost.MAX_DICE)
+        self.assertEqual(total, cost.MAX_DICE)
+
+    def test_is_unfulfillable(self):
+        self.assertTrue(issubclass(TooExpensiveError,
+                                   UnfulfillableRequestError))
+
+    def test_rejections_counted(self):
+        before = cost.REJECTIONS.labels("dice").value()
+        with self.assertRaises(TooExpensiveError):
+            roll("1000000000d6")
+        self.assertEqual(cost.REJECTIONS.labels("dice").value(), before + 1)
+
+    def test_budgets_exported(self):
+        self.assertEqual(cost.BUDGETS.labels("dice").value(), cost.MAX_DICE)
+
+
+if __name__ == '__main__':
+    absltest.main()
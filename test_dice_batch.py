@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import flagsaver
+from absl import app as absl_app
+from unittest import mock
+
+import dice_batch
+
+
+class MainTest(absltest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Only absltest.main parses flags, not other test runners
+        if not dice_batch.FLAGS.is_parsed():
+            dice_batch.FLAGS.mark_as_parsed()
+
+    def test_main(self):
+        path = os.path.join(tempfile.mkdtemp(), "specs.txt")
+        with open(path, "w") as f:
+            f.writelines(["1+1\n", "gibberish\n", "2d1\n"])
+        with flagsaver.flagsaver(input=path, processes=1), \
+                mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            dice_batch.main(["dice_batch.py"])
+        results = [json.loads(line)
+                   for line in stdout.getvalue().splitlines()]
+        self.assertEqual([r["dice_spec"] for r in results],
+                         ["1+1", "gibberish", "2d1"])
+        self.assertEqual(results[0]["total"], 2)
+        self.assertIn("error", results[1])
+        self.assertEqual(results[2]["dice"], [1, 1])
+
+    def test_specs_not_arguments(self):
+        with self.assertRaises(absl_app.UsageError):
+            dice_batch.main(["dice_batch.py", "1d6"])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -1,8 +1,23 @@
 #!/usr/bin/env python3
 
-from dice_calculator import roll, describe_dice
+import dice_calculator
+from dice_calculator import (
+    roll, roll_batch, roll_lines, describe_dice, dice_payload, resolve,
+    reroll, roll_with_plan, FOLLOWUPS, PLAN_CACHE, PLANS_BY_ID, STAGE_SECONDS,
+    ROLL_ERRORS)
+from exceptions import RecognitionError, UnfulfillableRequestError
+from sampling import DiceResults
 from absl.testing import absltest
+import json
+import metrics
 import unittest
+from unittest import mock
+
+
+def dice_results(*dice):
+    results = DiceResults()
+    results.extend(list(dice))
+    return results
 
 
 class RollTest(absltest.TestCase):
@@ -41,16 +56,211 @@ class RollTest(absltest.TestCase):
         self.assertLen(dice, 13)
 
 
+class PlanCacheTest(absltest.TestCase):
+    def setUp(self):
+        PLAN_CACHE.clear()
+
+    def test_normalized_hit(self):
+        resolve("Fireball  at level 5")
+        resolve("fireball at LEVEL 5")
+        self.assertEqual(PLAN_CACHE.stats()["hits"], 1)
+        self.assertLen(PLAN_CACHE, 1)
+
+    def test_roll_does_not_mutate_plan(self):
+        for spec, num_dice in (("critical longsword", 2),
+                               ("2d6 with advantage", 4)):
+            plan = resolve(spec).ir
+            before = repr(plan)
+            for _ in range(3):
+                _, dice = roll(spec)
+                self.assertLen(dice, num_dice)
+            self.assertEqual(repr(plan), before)
+        self.assertEqual(PLAN_CACHE.stats()["hits"], 6)
+
+    def test_errors_not_cached(self):
+        with self.assertRaises(UnfulfillableRequestError):
+            roll("unparsable gibberish")
+        self.assertLen(PLAN_CACHE, 0)
+
+
+class RerollTest(absltest.TestCase):
+    def setUp(self):
+        PLAN_CACHE.clear()
+        PLANS_BY_ID.clear()
+
+    def test_same_plan(self):
+        plan, _, _ = roll_with_plan("2d6 + 1")
+        hits = FOLLOWUPS.labels("hit").value()
+        again, total, dice = reroll(plan.id, "2d6 + 1")
+        self.assertIs(again, plan)
+        self.assertLen(dice, 2)
+        self.assertEqual(total, sum(dice) + 1)
+        self.assertEqual(FOLLOWUPS.labels("hit").value(), hits + 1)
+        self.assertEqual(PLAN_CACHE.stats()["misses"], 1)
+        self.assertEqual(PLAN_CACHE.stats()["hits"], 0)
+
+    def test_id_from_content(self):
+        # Specs that normalize differently still resolve to the same plan
+        self.assertEqual(resolve("2d6 + 1").id, resolve("2D6+1").id)
+        self.assertNotEqual(resolve("2d6 + 1").id, resolve("2d6 + 2").id)
+
+    def test_evicted(self):
+        plan = resolve("2d6 + 1")
+        PLAN_CACHE.clear()
+        PLANS_BY_ID.clear()
+        misses = FOLLOWUPS.labels("miss").value()
+        again, _, _ = reroll(plan.id, "2d6 + 1")
+        self.assertEqual(again.id, plan.id)
+        self.assertEqual(FOLLOWUPS.labels("miss").value(), misses + 1)
+        self.assertEqual(PLAN_CACHE.stats()["misses"], 1)
+
+    def test_nothing_to_reroll(self):
+        with self.assertRaises(RecognitionError):
+            reroll(None, None)
+        with self.assertRaises(RecognitionError):
+            reroll("no such plan", None)
+
+    def test_with_advantage(self):
+        plan = resolve("1d20 + 5")
+        advantage, total, dice = reroll(plan.id, "1d20 + 5", "advantage")
+        self.assertLen(dice, 2)
+        self.assertEqual(total, max(dice) + 5)
+        self.assertEqual(advantage.id, resolve("1d20 with advantage + 5").id)
+        self.assertIs(reroll(plan.id, None, "advantage")[0], advantage)
+        self.assertEqual(reroll(advantage.id, None)[0].id, advantage.id)
+        _, total, dice = reroll(plan.id, None, "disadvantage")
+        self.assertEqual(total, min(dice) + 5)
+
+    def test_unknown_modifier(self):
+        plan = resolve("1d20")
+        with self.assertRaisesRegex(RecognitionError, "(?i)sorry"):
+            reroll(plan.id, "1d20", "inspiration")
+
+
+class RollBatchTest(absltest.TestCase):
+    def test_results_in_order(self):
+        results = roll_batch(["1+1", "2d6", "Blowgun"])
+        self.assertEqual([r["dice_spec"] for r in results],
+                         ["1+1", "2d6", "Blowgun"])
+        self.assertEqual(results[0], {"dice_spec": "1+1", "total": 2,
+                                      "dice": []})
+        self.assertLen(results[1]["dice"], 2)
+        self.assertEqual(results[2]["total"], 1)
+
+    def test_errors_isolated(self):
+        results = roll_batch(["unparsable gibberish", 7, "3", "0d6"])
+        self.assertRegex(results[0]["error"], "(?i)sorry")
+        self.assertRegex(results[1]["error"], "(?i)sorry")
+        self.assertEqual(results[2]["total"], 3)
+        self.assertRegex(results[3]["error"], "(?i)sorry")
+        self.assertNotIn("total", results[0])
+
+    def test_resolves_once(self):
+        PLAN_CACHE.clear()
+        roll_batch(["1d6", "1D6", " 1d6 "])
+        self.assertEqual(PLAN_CACHE.stats()["misses"], 1)
+        self.assertEqual(PLAN_CACHE.stats()["hits"], 0)
+
+
+class RollLinesTest(absltest.TestCase):
+    LINES = ["1+1\n", "gibberish\n", "2d1\r\n", "\n", "Blowgun"]
+
+    def results(self, **kwargs):
+        return [json.loads(line)
+                for lines in roll_lines(self.LINES, **kwargs)
+                for line in lines.splitlines()]
+
+    def check(self, results):
+        self.assertEqual([r["dice_spec"] for r in results],
+                         ["1+1", "gibberish", "2d1", "", "Blowgun"])
+        self.assertEqual(results[0], {"dice_spec": "1+1", "total": 2,
+                                      "dice": []})
+        self.assertRegex(results[1]["error"], "(?i)sorry")
+        self.assertEqual(results[2]["dice"], [1, 1])
+        self.assertIn("error", results[3])
+        self.assertEqual(results[4]["total"], 1)
+
+    def test_inline(self):
+        self.check(self.results(chunk_size=2))
+
+    def test_process_pool_keeps_order(self):
+        self.check(self.results(processes=2, chunk_size=1))
+
+    def test_chunks_stream(self):
+        chunks = list(roll_lines(["1"] * 5, chunk_size=2))
+        self.assertEqual([c.count("\n") for c in chunks], [2, 2, 1])
+
+
+class MetricsTest(absltest.TestCase):
+    def stage_count(self, stage):
+        counts, _ = STAGE_SECONDS.labels(stage).snapshot()
+        return sum(counts)
+
+    def test_stages_timed(self):
+        PLAN_CACHE.clear()
+        stages = ("initial_parse", "number_transform", "dnd_knowledge",
+                  "simplify", "crit_transform", "compile", "final_eval")
+        before = {stage: self.stage_count(stage) for stage in stages}
+        roll("fireball")
+        for stage in stages:
+            self.assertEqual(self.stage_count(stage), before[stage] + 1,
+                             stage)
+
+    def test_plan_caches_exported(self):
+        PLAN_CACHE.clear()
+        resolve("1d6")
+        resolve("1d6")
+        rendered = metrics.render()
+        for line in ('dice_plan_cache_events_total{cache="spec",event="hit"} 1',
+                     'dice_plan_cache_events_total{cache="spec",event="miss"} 1',
+                     'dice_plan_cache_entries{cache="spec",entries="size"} 1',
+                     'dice_plan_cache_entries{cache="id",entries="maxsize"} %d'
+                     % PLANS_BY_ID.maxsize):
+            self.assertIn(line + "\n", rendered)
+
+    def test_errors_counted_by_class(self):
+        before = ROLL_ERRORS.labels("RecognitionError").value()
+        with self.assertRaises(UnfulfillableRequestError):
+            roll("unparsable gibberish")
+        roll_batch(["unparsable gibberish", 7])
+        self.assertEqual(ROLL_ERRORS.labels("RecognitionError").value(),
+                         before + 3)
+
+
 class DescribeDiceTest(unittest.TestCase):
     def test_one_dice(self):
-        self.assertEqual(describe_dice([1]), "")
-        self.assertEqual(describe_dice([3]), "")
+        self.assertEqual(describe_dice(dice_results(1)), "")
+        self.assertEqual(describe_dice(dice_results(3)), "")
 
     def test_two_dice(self):
-        self.assertIn("1 and 2", describe_dice([1, 2]))
+        self.assertIn("1 and 2", describe_dice(dice_results(1, 2)))
 
     def test_four_dice(self):
-        self.assertIn("1, 2, 3 and 4", describe_dice([1, 2, 3, 4]))
+        self.assertIn("1, 2, 3 and 4",
+                      describe_dice(dice_results(1, 2, 3, 4)))
+
+    def test_many_dice(self):
+        description = describe_dice(dice_results(*range(1, 101)))
+        self.assertEqual(description, " from 100 dice, the highest 100, 99 "
+                         "and 98 and the lowest 1, 2 and 3")
+
+
+class DicePayloadTest(absltest.TestCase):
+    def test_listed(self):
+        self.assertEqual(dice_payload(dice_results(4, 2)), {"dice": [4, 2]})
+        self.assertEqual(dice_payload(DiceResults()), {"dice": []})
+
+    @mock.patch.object(dice_calculator, "MAX_LISTED_DICE", 3)
+    def test_summarized(self):
+        self.assertEqual(dice_payload(dice_results(5, 1, 6, 2)), {
+            "dice_summary": {"count": 4, "highest": [6, 5, 2],
+                             "lowest": [1, 2, 5]}})
+
+    def test_batch_bounded(self):
+        result, = roll_batch(["10000d6"])
+        self.assertNotIn("dice", result)
+        self.assertEqual(result["dice_summary"]["count"], 10000)
+        self.assertLen(result["dice_summary"]["highest"], 3)
 
 
 if __name__ == '__main__':
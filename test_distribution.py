@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import itertools
+
+from absl.testing import absltest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy is not None:
+    import distribution
+    from distribution import dice, tree_distribution
+from dice_calculator import distribution as spec_distribution
+from exceptions import ImpossibleDiceError, IncalculableOddsError
+from ir import Node
+
+
+def brute_force(count, sides):
+    counts = {}
+    for rolls in itertools.product(range(1, sides + 1), repeat=count):
+        counts[sum(rolls)] = counts.get(sum(rolls), 0) + 1
+    total = sides ** count
+    return {k: v / total for k, v in counts.items()}
+
+
+@absltest.skipIf(numpy is None, "numpy isn't installed")
+class DistributionTest(absltest.TestCase):
+    def assertDistributionAlmostEqual(self, d, expected):
+        self.assertEqual(d.min, min(expected))
+        self.assertEqual(d.max, max(expected))
+        for value, p in expected.items():
+            self.assertAlmostEqual(d.probability(value), p)
+
+    def test_dice(self):
+        self.assertDistributionAlmostEqual(dice(3, 6), brute_force(3, 6))
+        self.assertDistributionAlmostEqual(dice(4, 4), brute_force(4, 4))
+
+    def test_large_dice_uses_fft(self):
+        d = dice(100, 100)
+        self.assertAlmostEqual(d.pmf.sum(), 1)
+        self.assertAlmostEqual(d.mean(), 100 * 50.5, places=6)
+        self.assertAlmostEqual(d.variance(), 100 * (100**2 - 1) / 12,
+                               places=3)
+        self.assertGreaterEqual(d.pmf.min(), 0)
+
+    def test_memoized(self):
+        self.assertIs(dice(7, 8), dice(7, 8))
+        self.assertFalse(dice(7, 8).pmf.flags.writeable)
+
+    def test_impossible_dice(self):
+        with self.assertRaises(ImpossibleDiceError):
+            dice(0, 6)
+        with self.assertRaises(ImpossibleDiceError):
+            dice(1, 0)
+
+    def test_too_large(self):
+        with self.assertRaises(IncalculableOddsError):
+            dice(10**6, 10**6)
+
+    def test_add_sub(self):
+        tree = Node("sub", Node("add", Node("roll_n", 1, 6), 2),
+                    Node("roll_n", 1, 4))
+        expected = {}
+        for a in range(1, 7):
+            for b in range(1, 5):
+                expected[a + 2 - b] = expected.get(a + 2 - b, 0) + 1 / 24
+        self.assertDistributionAlmostEqual(tree_distribution(tree), expected)
+
+    def test_mul(self):
+        tree = Node("mul", Node("roll_n", 1, 3), Node("roll_n", 1, 3))
+        expected = {}
+        for a in range(1, 4):
+            for b in range(1, 4):
+                expected[a * b] = expected.get(a * b, 0) + 1 / 9
+        d = tree_distribution(tree)
+        self.assertDistributionAlmostEqual(d, expected)
+        self.assertEqual(d.probability(5), 0)
+
+    def test_mul_constant(self):
+        d = tree_distribution(Node("mul", Node("roll_n", 1, 4), -3))
+        self.assertDistributionAlmostEqual(
+            d, {-3: .25, -6: .25, -9: .25, -12: .25})
+
+    def test_advantage(self):
+        d = tree_distribution(
+            Node("max", Node("roll_n", 1, 20), Node("roll_n", 1, 20)))
+        self.assertAlmostEqual(d.mean(), 13.825)
+        self.assertAlmostEqual(d.probability(20), 39 / 400)
+
+    def test_disadvantage(self):
+        d = tree_distribution(
+            Node("min", Node("roll_n", 1, 20), Node("roll_n", 1, 20)))
+        self.assertAlmostEqual(d.mean(), 7.175)
+        self.assertAlmostEqual(d.probability(1), 39 / 400)
+
+    def test_random_dice_size(self):
+        d = tree_distribution(Node("roll_n", 1, Node("roll_n", 1, 2)))
+        self.assertDistributionAlmostEqual(d, {1: .75, 2: .25})
+
+    def test_random_dice_size_too_large(self):
+        for dice_spec in ("(1d100)d(1d100)", "(1d1000)d(1d1000)",
+                          "(1d2)d1000000000"):
+            with self.assertRaises(IncalculableOddsError, msg=dice_spec):
+                spec_distribution(dice_spec)
+
+    def test_mul_spread_too_wide(self):
+        with self.assertRaises(IncalculableOddsError):
+            spec_distribution("(1d100 + 1000000000) * 1d100")
+
+    def test_constant(self):
+        d = tree_distribution(3)
+        self.assertEqual(d.summary()["p50"], 3)
+        self.assertEqual(d.variance(), 0)
+
+    def test_percentiles(self):
+        d = dice(1, 4)
+        self.assertEqual(d.percentile(25), 1)
+        self.assertEqual(d.percentile(50), 2)
+        self.assertEqual(d.percentile(100), 4)
+
+    def test_spec(self):
+        d = spec_distribution("20d20 + fireball at level 9")
+        # fireball is 8d6 at 3rd level plus 1d6 per level above that
+        self.assertAlmostEqual(d.mean(), 20 * 10.5 + 14 * 3.5)
+        self.assertEqual(d.min, 34)
+        self.assertEqual(d.max, 484)
+
+
+if __name__ == '__main__':
+    absltest.main()
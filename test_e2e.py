@@ -5,15 +5,23 @@ from flask import Flask, request
 import unittest
 import json
 
-from main import handleHttp
+from main import handleHttp, handleBatch, handleJsonRoll
 
 
-class E2ETest(unittest.TestCase):
+class E2ETest(absltest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
         @self.app.route('/', methods=['GET', 'POST'])
         def index():
             return handleHttp(request)
+
+        @self.app.route('/roll', methods=['POST'])
+        def json_roll():
+            return handleJsonRoll(request)
+
+        @self.app.route('/batch', methods=['POST'])
+        def batch():
+            return handleBatch(request)
         self.app.testing = True
         self.client = self.app.test_client()
 
@@ -47,6 +55,53 @@ class E2ETest(unittest.TestCase):
         text = resp_json["fulfillmentMessages"][0]["text"]["text"][0]
         self.assertRegex(text, "(?i)sorry")
 
+    def test_json_roll(self):
+        resp = self.client.post("/roll", json={"dice_spec": "1d1 + 2"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), {
+            "dice_spec": "1d1 + 2", "total": 3, "dice": [1],
+            "text": "You rolled a total of 3"})
+
+    def test_json_roll_many_dice(self):
+        resp = self.client.post("/roll", json={"dice_spec": "10000d1"})
+        self.assertEqual(json.loads(resp.data), {
+            "dice_spec": "10000d1", "total": 10000,
+            "dice_summary": {"count": 10000, "highest": [1, 1, 1],
+                             "lowest": [1, 1, 1]},
+            "text": "You rolled a total of 10000 from 10000 dice, the "
+                    "highest 1, 1 and 1 and the lowest 1, 1 and 1"})
+
+    def test_json_roll_error(self):
+        resp = self.client.post(
+            "/roll", json={"dice_spec": "unparsable gibberish"})
+        self.assertEqual(resp.status_code, 422)
+        self.assertRegex(json.loads(resp.data)["error"], "(?i)sorry")
+
+    def test_json_roll_bad_request(self):
+        resp = self.client.post("/roll", json={"dice_specs": ["3"]})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_batch(self):
+        resp = self.client.post("/batch", json={"dice_specs": [
+            "3", "unparsable gibberish", "1d6", "3"]})
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.data)["results"]
+        self.assertLen(results, 4)
+        self.assertEqual(results[0], {"dice_spec": "3", "total": 3, "dice": []})
+        self.assertRegex(results[1]["error"], "(?i)sorry")
+        self.assertLen(results[2]["dice"], 1)
+        self.assertEqual(results[3]["total"], 3)
+
+    def test_batch_bad_request(self):
+        resp = self.client.post("/batch", json={"dice_spec": "3"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post("/batch", data="not json")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_batch_too_large(self):
+        resp = self.client.post("/batch", json={"dice_specs": ["1"] * 1000})
+        self.assertEqual(resp.status_code, 413)
+
 
 if __name__ == '__main__':
     absltest.main()
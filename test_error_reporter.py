@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import gc
+import threading
+import traceback
+import weakref
+
+from absl.testing import absltest
+
+import error_reporter
+from error_reporter import ErrorReporter
+
+
+class FakeClient:
+    def __init__(self, block: threading.Event = None):
+        self.reports = []
+        self.block = block
+
+    def report(self, message, http_context=None):
+        if self.block is not None:
+            self.block.wait()
+        self.reports.append((message, http_context))
+
+    def report_exception(self, http_context=None):
+        self.reports.append((traceback.format_exc(), http_context))
+
+
+class ErrorReporterTest(absltest.TestCase):
+    def test_reports_in_background(self):
+        client = FakeClient()
+        reporter = ErrorReporter(lambda: client)
+        self.addCleanup(reporter.stop)
+        self.assertTrue(reporter.report("oops", "context"))
+        reporter.flush()
+        self.assertEqual(client.reports, [("oops", "context")])
+        self.assertEqual(reporter.stats()["reported"], 1)
+        self.assertNotEqual(reporter._thread, threading.current_thread())
+
+    def test_exception_keeps_traceback(self):
+        client = FakeClient()
+        reporter = ErrorReporter(lambda: client)
+        self.addCleanup(reporter.stop)
+
+        def raise_error():
+            raise ValueError("bad dice")
+        try:
+            raise_error()
+        except ValueError:
+            self.assertTrue(reporter.report_exception("context"))
+        reporter.flush()
+        [(message, context)] = client.reports
+        self.assertEqual(context, "context")
+        # The innermost frame is still where it was raised
+        self.assertRegex(message, r"in raise_error\n.*\nValueError: bad dice")
+
+    def test_client_made_once(self):
+        clients = []
+
+        def factory():
+            clients.append(FakeClient())
+            return clients[-1]
+        reporter = ErrorReporter(factory)
+        self.addCleanup(reporter.stop)
+        for i in range(25):
+            reporter.report(str(i))
+        reporter.flush()
+        self.assertLen(clients, 1)
+        self.assertEqual([m for m, _ in clients[0].reports],
+                         [str(i) for i in range(25)])
+
+    def test_drops_on_overflow(self):
+        block = threading.Event()
+        client = FakeClient(block)
+        reporter = ErrorReporter(lambda: client, max_queue=2, batch_size=1)
+        self.addCleanup(reporter.stop)
+        results = [reporter.report(str(i)) for i in range(10)]
+        block.set()
+        reporter.flush()
+        self.assertIn(False, results)
+        stats = reporter.stats()
+        self.assertEqual(stats["dropped"], results.count(False))
+        self.assertEqual(stats["reported"], results.count(True))
+        self.assertEqual(stats["dropped"] + stats["queued"], 10)
+
+    def test_failures_counted(self):
+        def factory():
+            raise RuntimeError("no credentials")
+        reporter = ErrorReporter(factory)
+        self.addCleanup(reporter.stop)
+        reporter.report("oops")
+        reporter.report("oops again")
+        reporter.flush()
+        self.assertEqual(reporter.stats()["failed"], 2)
+
+    def test_stop_sends_pending(self):
+        client = FakeClient()
+        reporter = ErrorReporter(lambda: client)
+        reporter.report("last words")
+        reporter.stop()
+        self.assertEqual(client.reports, [("last words", None)])
+        self.assertIsNone(reporter._thread)
+
+    def test_stop_with_full_queue(self):
+        block = threading.Event()
+        self.addCleanup(block.set)
+        reporter = ErrorReporter(lambda: FakeClient(block), max_queue=1,
+                                 batch_size=1)
+        for i in range(3):
+            reporter.report(str(i))
+        reporter.stop(timeout=0.1)
+        self.assertIsNone(reporter._thread)
+
+    def test_not_kept_alive(self):
+        reporter = ErrorReporter(FakeClient)
+        self.assertIn(reporter, error_reporter._REPORTERS)
+        ref = weakref.ref(reporter)
+        del reporter
+        gc.collect()
+        self.assertIsNone(ref())
+
+
+if __name__ == '__main__':
+    absltest.main()
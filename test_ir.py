@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+from absl.testing import absltest
+from lark import Token, Tree
+
+from dice_calculator import resolve
+from ir import (
+    apply_crit, digest, evaluate, fold, from_tree, resolve_names, scale,
+    simplify, Node)
+from knowledge import named_damage
+from parser import parse
+
+
+def roll_n(count, sides):
+    return Node("roll_n", count, sides)
+
+
+class NodeTest(absltest.TestCase):
+    def test_equality(self):
+        self.assertEqual(Node("add", roll_n(1, 6), 2),
+                         Node("add", roll_n(1, 6), 2))
+        self.assertNotEqual(Node("add", roll_n(1, 6), 2),
+                            Node("add", roll_n(1, 8), 2))
+        self.assertNotEqual(roll_n(1, 6), 1)
+        self.assertNotEqual(1, roll_n(1, 6))
+
+    def test_deep_equality(self):
+        a = b = 1
+        for _ in range(100000):
+            a, b = Node("add", a, 1), Node("add", b, 1)
+        self.assertEqual(a, b)
+
+    def test_digest(self):
+        self.assertEqual(digest(Node("add", roll_n(1, 6), 2)),
+                         digest(Node("add", roll_n(1, 6), 2)))
+        self.assertNotEqual(digest(Node("add", roll_n(1, 6), 2)),
+                            digest(Node("add", roll_n(1, 6), 3)))
+        self.assertNotEqual(digest(Node("add", roll_n(1, 6), 2)),
+                            digest(Node("add", 2, roll_n(1, 6))))
+        self.assertNotEqual(digest(3), digest(4))
+        self.assertLen(digest(3), 32)
+
+    def test_repr(self):
+        self.assertEqual(repr(Node("critical", roll_n(1, 6))),
+                         "Node('critical', Node('roll_n', 1, 6))")
+
+
+class FoldTest(absltest.TestCase):
+    def test_left_first(self):
+        visited = []
+
+        def combine(node, left, right):
+            visited.append(node.op)
+            return left + right
+        node = Node("add", Node("sub", 1, 2), Node("mul", 3, 4))
+        self.assertEqual(fold(node, combine), 10)
+        self.assertEqual(visited, ["sub", "mul", "add"])
+
+    def test_shared(self):
+        visited = []
+
+        def combine(node, left, right):
+            visited.append(node.op)
+            return left + right
+        dice = roll_n(1, 6)
+        node = Node("add", dice, dice)
+        self.assertEqual(fold(node, combine), 14)
+        self.assertLen(visited, 3)
+        visited.clear()
+        self.assertEqual(fold(node, combine, shared=True), 14)
+        self.assertLen(visited, 2)
+
+    def test_deep(self):
+        node = 0
+        for _ in range(100000):
+            node = Node("add", node, 1)
+        self.assertEqual(fold(node, lambda n, a, b: a + b), 100000)
+
+    def test_evaluate(self):
+        class Visitor:
+            def add(self, a, b):
+                return a + b
+
+            def roll_n(self, count, sides):
+                return count * sides
+        self.assertEqual(evaluate(Node("add", roll_n(2, 6), 3), Visitor()),
+                         15)
+
+
+class FromTreeTest(absltest.TestCase):
+    def test_parse_tree(self):
+        self.assertEqual(from_tree(parse("2d6 + d4")),
+                         Node("add", roll_n(2, 6), roll_n(1, 4)))
+        self.assertEqual(from_tree(parse("to hit with advantage")),
+                         Node("advantage", roll_n(1, 20)))
+
+    def test_names(self):
+        self.assertEqual(from_tree(parse("critical longsword")),
+                         Node("critical", Node("weapon", "longsword")))
+        self.assertEqual(from_tree(parse("fireball")),
+                         Node("spell", "fireball"))
+        self.assertEqual(from_tree(parse("fireball at level 5")),
+                         Node("spell", "fireball", 5))
+        self.assertEqual(from_tree(parse("5th level fireball")),
+                         Node("spell", "fireball", 5))
+
+    def test_transformed_tree(self):
+        self.assertEqual(from_tree(Tree("start", [Tree("roll_n", [3, 6])])),
+                         roll_n(3, 6))
+        self.assertEqual(from_tree(7), 7)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            from_tree(Tree("spork", [1]))
+        with self.assertRaises(ValueError):
+            from_tree(Token("SPORK", "spork"))
+
+
+class StagesTest(absltest.TestCase):
+    def test_simplify(self):
+        self.assertEqual(
+            simplify(Node("add", Node("add", roll_n(1, 6), roll_n(2, 6)),
+                          roll_n(3, 6))),
+            roll_n(6, 6))
+        self.assertEqual(simplify(from_tree(parse("d6 + d6"))), roll_n(2, 6))
+        unchanged = Node("add", roll_n(1, 6), roll_n(1, 8))
+        self.assertIs(simplify(unchanged), unchanged)
+
+    def test_simplify_needs_fixed_dice(self):
+        # The die sizes are rolled separately, so can't be merged
+        node = Node("add", roll_n(1, roll_n(1, 4)), roll_n(1, roll_n(1, 4)))
+        self.assertEqual(simplify(node), node)
+
+    def test_critical(self):
+        self.assertEqual(apply_crit(Node("critical", 1)), 1)
+        self.assertEqual(
+            apply_crit(Node("critical", Node("add", roll_n(1, 8), 3))),
+            Node("add", roll_n(2, 8), 3))
+        self.assertEqual(apply_crit(Node("critical", roll_n(roll_n(1, 4), 6))),
+                         roll_n(Node("mul", roll_n(2, 4), 2), 6))
+
+    def test_advantage_shares_dice(self):
+        node = apply_crit(Node("advantage", roll_n(1, 20)))
+        self.assertEqual(node.op, "max")
+        self.assertIs(node.left, node.right)
+        node = apply_crit(Node("disadvantage", roll_n(1, 20)))
+        self.assertEqual(node.op, "min")
+
+    def test_unchanged_nodes_shared(self):
+        dice = Node("add", roll_n(1, 6), 1)
+        node = Node("add", dice, Node("critical", roll_n(1, 8)))
+        self.assertIs(apply_crit(node).left, dice)
+
+    def test_resolve_names(self):
+        self.assertEqual(
+            resolve_names(Node("add", Node("weapon", "club"), 1),
+                          named_damage),
+            Node("add", roll_n(1, 4), 1))
+
+    def test_scale(self):
+        self.assertEqual(scale(Node("add", roll_n(1, 6), 2), 3),
+                         Node("add", roll_n(3, 6), 6))
+        dice = Node("mul", roll_n(1, 6), 2)
+        self.assertEqual(scale(dice, 3),
+                         Node("add", Node("add", dice, dice), dice))
+
+    def test_scale_needs_fixed_dice(self):
+        # Each term rolls its own die size, so can't be merged
+        dice = roll_n(1, roll_n(1, 6))
+        self.assertEqual(scale(dice, 2), Node("add", dice, dice))
+
+
+class ResolvedSpecsTest(absltest.TestCase):
+    def test_specs(self):
+        # What the Lark transformers this replaced resolved these to
+        d20, d4 = roll_n(1, 20), roll_n(1, 4)
+        d4_with_advantage = roll_n(Node("max", d4, d4), 6)
+        for dice_spec, expected in [
+                ("2d6", roll_n(2, 6)),
+                ("d20 + 5", Node("add", d20, 5)),
+                ("1d6 + 1d6 + 2", Node("add", roll_n(2, 6), 2)),
+                ("2d(1d4) times 3", Node("mul", roll_n(2, d4), 3)),
+                ("(1+2)d6 - 3", Node("sub", roll_n(Node("add", 1, 2), 6), 3)),
+                ("4 sided die", d4),
+                ("fireball", roll_n(8, 6)),
+                ("level 5 fireball", roll_n(10, 6)),
+                ("fireball at level 100", roll_n(105, 6)),
+                ("critical fireball at level 9", roll_n(28, 6)),
+                ("critical longsword", roll_n(2, 8)),
+                ("critical meteor swarm", roll_n(40, 6)),
+                ("3d20 + fireball at level 5",
+                 Node("add", roll_n(3, 20), roll_n(10, 6))),
+                ("to hit with advantage", Node("max", d20, d20)),
+                ("2d6 with disadvantage",
+                 Node("min", roll_n(2, 6), roll_n(2, 6))),
+                ("(1d4)d6 with advantage",
+                 Node("max", d4_with_advantage, d4_with_advantage))]:
+            self.assertEqual(resolve(dice_spec).ir, expected, dice_spec)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+from absl.testing import absltest
+
+from exceptions import ImpossibleSpellError, RecognitionError
+from ir import Node
+from knowledge import (
+    get_damage_table, named_damage, spell_damage, weapon_damage, DamageDice)
+from knowledge_store import spells, weapons, Spell, Weapon
+
+
+class DamageTableTest(absltest.TestCase):
+    def test_covers_everything(self):
+        table = get_damage_table()
+        self.assertLen(table.spells, len(spells()))
+        self.assertLen(table.weapons, len(weapons()))
+
+    def test_spell(self):
+        damage = spell_damage(Spell("Zap", 1, "2d6", "1d6"))
+        self.assertEqual(damage.base.dice_spec, "2d6")
+        self.assertEqual(damage.base.get(), Node("roll_n", 2, 6))
+        self.assertEqual(damage.per_level.dice_spec, "1d6")
+
+    def test_spell_without_dice(self):
+        damage = spell_damage(Spell("Nap", 1, None, None))
+        with self.assertRaisesRegex(ImpossibleSpellError, "Nap"):
+            damage.base.get()
+        with self.assertRaisesRegex(ImpossibleSpellError, "Nap"):
+            damage.per_level.get()
+
+    def test_weapon(self):
+        damage = weapon_damage(Weapon("Net", "0"))
+        self.assertEqual(damage.dice_spec, "0")
+        self.assertEqual(damage.get(), 0)
+
+    def test_simplified(self):
+        damage = spell_damage(Spell("Zap", 1, "2d6 + 1d6", "1d6"))
+        self.assertEqual(damage.base.get(), Node("roll_n", 3, 6))
+
+    def test_error_wins(self):
+        with self.assertRaises(ImpossibleSpellError):
+            DamageDice("1d6", None, "Sorry").get()
+
+
+class NamedDamageTest(absltest.TestCase):
+    def test_weapon(self):
+        self.assertEqual(named_damage(Node("weapon", "club")),
+                         Node("roll_n", 1, 4))
+        self.assertEqual(named_damage(Node("weapon", "Blowgun")), 1)
+
+    def test_aliases(self):
+        self.assertEqual(named_damage(Node("weapon", "cLuB")),
+                         Node("roll_n", 1, 4))
+        self.assertEqual(named_damage(Node("weapon", "crossbow light")),
+                         Node("roll_n", 1, 8))
+        for name in ("Hunter's Mark", "hunters mark", "HUNTER\u2019S MARK"):
+            self.assertEqual(named_damage(Node("spell", name)),
+                             Node("roll_n", 1, 6))
+
+    def test_spell(self):
+        self.assertEqual(named_damage(Node("spell", "fireball")),
+                         Node("roll_n", 8, 6))
+        self.assertEqual(named_damage(Node("spell", "fireball", 3)),
+                         Node("roll_n", 8, 6))
+
+    def test_upcast(self):
+        self.assertEqual(named_damage(Node("spell", "fireball", 5)),
+                         Node("add", Node("roll_n", 8, 6),
+                              Node("roll_n", 2, 6)))
+        self.assertEqual(named_damage(Node("spell", "fireball", 100)),
+                         Node("add", Node("roll_n", 8, 6),
+                              Node("roll_n", 97, 6)))
+
+    def test_impossible_levels(self):
+        with self.assertRaisesRegex(ImpossibleSpellError, "level 3"):
+            named_damage(Node("spell", "fireball", 2))
+        with self.assertRaisesRegex(ImpossibleSpellError, "above level"):
+            named_damage(Node("spell", "fireball", 101))
+        with self.assertRaises(ImpossibleSpellError):
+            named_damage(Node("spell", "fireball", 10**9))
+
+    def test_unknown(self):
+        with self.assertRaises(RecognitionError):
+            named_damage(Node("weapon", "spork"))
+        with self.assertRaises(RecognitionError):
+            named_damage(Node("spell", "spork"))
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import tempfile
+
+from absl.testing import absltest
+from unittest import mock
+
+import knowledge_store
+from knowledge_store import (
+    build_store, open_store, populate, name_aliases, find_spell, find_weapon,
+    spells, weapons, Spell, Weapon)
+
+
+class NameAliasesTest(absltest.TestCase):
+    def test_aliases(self):
+        self.assertEqual(
+            name_aliases("Hunter's Mark"),
+            ["Hunter's Mark", "Hunters Mark", "Hunter\u2019s Mark"])
+        self.assertIn("Crossbow light", name_aliases("Crossbow, light"))
+        self.assertIn("Enlarge Reduce", name_aliases("Enlarge/Reduce"))
+
+
+class PopulateTest(absltest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        populate(self.conn, [
+            {"name": "Hunter's Mark", "level_int": 1,
+             "desc": "Deal an extra 1d6 damage.", "higher_level": "Longer."},
+            {"name": "hunter's mark", "level_int": 9, "desc": "Shadowed."},
+        ], [{"name": "Net", "damage_dice": 0}])
+
+    def test_extracts_dice(self):
+        self.assertEqual(
+            self.conn.execute("SELECT * FROM spells").fetchall(),
+            [("Hunter's Mark", 1, "1d6", None), ("hunter's mark", 9, None,
+                                                 None)])
+        self.assertEqual(self.conn.execute("SELECT * FROM weapons").fetchall(),
+                         [("Net", "0")])
+
+    def test_first_alias_wins(self):
+        self.assertEqual(
+            self.conn.execute(
+                "SELECT name FROM names WHERE alias = 'hunters mark'"
+            ).fetchall(),
+            [("Hunter's Mark",)])
+
+
+class StoreFileTest(absltest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "knowledge.sqlite")
+
+    def test_round_trip(self):
+        build_store(self.path)
+        conn = open_store(self.path)
+        self.assertEqual(
+            conn.execute("SELECT count(*) FROM spells").fetchone()[0],
+            len(spells()))
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM spells")
+
+    def test_missing(self):
+        self.assertIsNone(open_store(self.path))
+
+    def test_stale(self):
+        build_store(self.path)
+        with mock.patch.object(knowledge_store, "STORE_VERSION", -1):
+            self.assertIsNone(open_store(self.path))
+
+    def test_not_a_store(self):
+        with open(self.path, "w") as f:
+            f.write("not sqlite")
+        self.assertIsNone(open_store(self.path))
+
+
+class LookupTest(absltest.TestCase):
+    def test_find_spell(self):
+        self.assertEqual(find_spell("FIREBALL"),
+                         Spell("Fireball", 3, "8d6", "1d6"))
+        self.assertEqual(find_spell("hunters mark").name, "Hunter's Mark")
+        self.assertIsNone(find_spell("longsword"))
+
+    def test_find_weapon(self):
+        self.assertEqual(find_weapon("Longsword"),
+                         Weapon("Longsword", "1d8"))
+        self.assertEqual(find_weapon("crossbow light").name,
+                         "Crossbow, light")
+        self.assertIsNone(find_weapon("fireball"))
+
+    def test_lookups_dont_query(self):
+        find_spell("fireball")
+        with mock.patch.object(knowledge_store, "_get_store",
+                               side_effect=AssertionError("queried")):
+            self.assertEqual(find_spell("Fireball").name, "Fireball")
+            self.assertEqual(find_weapon("club").name, "Club")
+            self.assertIsNone(find_weapon("no such weapon"))
+
+    def test_listing_keeps_data_order(self):
+        self.assertEqual(spells()[0].name, "Acid Arrow")
+        self.assertEqual(weapons()[0], Weapon("Club", "1d4"))
+
+
+if __name__ == '__main__':
+    absltest.main()
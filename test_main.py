@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 
-from main import handleRoll
+import main
+from main import (
+    handleRoll, handleReroll, handleHttp, get_trace_config, shutdown_tracing)
+from dice_calculator import PLANS_BY_ID
 from exceptions import UnfulfillableRequestError
+import metrics
 
 from absl.testing import absltest
 from dialogflow_v2.types import WebhookRequest, WebhookResponse
+import json
+import threading
+import types
 import unittest
+from unittest import mock
 
 
 class HandleRollTest(unittest.TestCase):
@@ -16,6 +24,16 @@ class HandleRollTest(unittest.TestCase):
         res = WebhookResponse()
         handleRoll(req, res)
 
+    def test_many_dice_summarized(self):
+        req = WebhookRequest()
+        req.query_result.parameters["dice_spec"] = "10000d6"
+        res = WebhookResponse()
+        handleRoll(req, res)
+        parameters = res.output_contexts[0].parameters
+        self.assertNotIn("dice_results", parameters)
+        self.assertEqual(parameters["dice_summary"]["count"], 10000)
+        self.assertLess(len(res.fulfillment_messages[0].text.text[0]), 100)
+
     def test_graceful_error(self):
         req = WebhookRequest()
         req.query_result.parameters["dice_spec"] = "unparsable gibberish 1dd5"
@@ -25,5 +43,128 @@ class HandleRollTest(unittest.TestCase):
             handleRoll(req, res)
 
 
+class HandleRerollTest(absltest.TestCase):
+    def roll(self, dice_spec):
+        req = WebhookRequest()
+        req.session = "projects/p/agent/sessions/s"
+        req.query_result.parameters["dice_spec"] = dice_spec
+        res = WebhookResponse()
+        handleRoll(req, res)
+        return res
+
+    def reroll(self, previous, modifier=None):
+        req = WebhookRequest()
+        req.session = "projects/p/agent/sessions/s"
+        req.query_result.output_contexts.extend(previous.output_contexts)
+        if modifier:
+            req.query_result.parameters["modifier"] = modifier
+        res = WebhookResponse()
+        handleReroll(req, res)
+        return res
+
+    def test_context_refers_to_plan(self):
+        parameters = self.roll("2d6").output_contexts[0].parameters
+        self.assertEqual(parameters["dice_spec"], "2d6")
+        self.assertIsNotNone(PLANS_BY_ID.get(parameters["plan_id"]))
+
+    def test_reroll(self):
+        res = self.reroll(self.roll("1d1 + 2"))
+        self.assertIn("3", res.fulfillment_messages[0].text.text[0])
+        res = self.reroll(res, "advantage")
+        self.assertEqual(
+            list(res.output_contexts[0].parameters["dice_results"]), [1, 1])
+
+    def test_reroll_keeps_modifier(self):
+        res = self.reroll(self.roll("1d20"), "advantage")
+        parameters = res.output_contexts[0].parameters
+        self.assertEqual(parameters["modifier"], "advantage")
+        self.assertEqual(parameters["plan_id"],
+                         self.roll("1d20").output_contexts[0].parameters[
+                             "plan_id"])
+        for evict in (False, True, False, True):
+            if evict:
+                PLANS_BY_ID.clear()
+            res = self.reroll(res)
+            self.assertLen(res.output_contexts[0].parameters["dice_results"],
+                           2)
+        for evict in (False, True):
+            if evict:
+                PLANS_BY_ID.clear()
+            res = self.reroll(res, "advantage")
+            self.assertLen(res.output_contexts[0].parameters["dice_results"],
+                           2)
+        res = self.reroll(res, "disadvantage")
+        parameters = res.output_contexts[0].parameters
+        self.assertEqual(parameters["modifier"], "disadvantage")
+        self.assertLen(parameters["dice_results"], 2)
+
+    def test_reroll_evicted(self):
+        res = self.roll("1d1 + 2")
+        PLANS_BY_ID.clear()
+        res = self.reroll(res)
+        self.assertIn("3", res.fulfillment_messages[0].text.text[0])
+
+    def test_nothing_to_reroll(self):
+        with self.assertRaisesRegex(UnfulfillableRequestError, "(?i)sorry"):
+            self.reroll(WebhookResponse())
+
+
+class TracingTest(absltest.TestCase):
+    def setUp(self):
+        shutdown_tracing()
+        self.addCleanup(shutdown_tracing)
+        self.request = types.SimpleNamespace(headers={}, data=json.dumps({
+            "queryResult": {"action": "roll",
+                            "parameters": {"dice_spec": "1+1"}}}))
+
+    def test_config_shared(self):
+        self.assertIs(get_trace_config(), get_trace_config())
+
+    def test_no_thread_when_not_sampling(self):
+        before = threading.active_count()
+        handleHttp(self.request)
+        self.assertEqual(threading.active_count(), before)
+
+    @mock.patch.object(main, "TRACE_EXPORTER", "log")
+    def test_thread_count_flat(self):
+        handleHttp(self.request)
+        threads = threading.active_count()
+        for _ in range(1000):
+            handleHttp(self.request)
+        self.assertEqual(threading.active_count(), threads)
+
+    @mock.patch.object(main, "TRACE_EXPORTER", "log")
+    def test_shutdown_stops_thread(self):
+        before = threading.active_count()
+        handleHttp(self.request)
+        self.assertEqual(threading.active_count(), before + 1)
+        shutdown_tracing()
+        self.assertEqual(threading.active_count(), before)
+
+
+class ReportErrorTest(absltest.TestCase):
+    @mock.patch.object(main, "STACKDRIVER_ERROR_REPORTING", True)
+    @mock.patch("google.cloud.error_reporting.build_flask_context")
+    def test_queues_instead_of_sending(self, build_flask_context):
+        reporter = mock.Mock()
+        with mock.patch.object(main, "ERROR_REPORTER", reporter):
+            request = types.SimpleNamespace(headers={}, data=json.dumps({
+                "queryResult": {"action": "roll", "parameters": {
+                    "dice_spec": "unparsable gibberish"}}}))
+            handleHttp(request)
+        reporter.report.assert_not_called()
+        reporter.report_exception.assert_called_once_with(
+            build_flask_context.return_value)
+
+    def test_stats_exported(self):
+        reporter = mock.Mock()
+        reporter.stats.return_value = {
+            "queued": 5, "reported": 1, "dropped": 4, "failed": 0}
+        with mock.patch.object(main, "ERROR_REPORTER", reporter):
+            rendered = metrics.render()
+        self.assertIn('dice_error_reports_total{outcome="dropped"} 4\n',
+                      rendered)
+
+
 if __name__ == '__main__':
     absltest.main()
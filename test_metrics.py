@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import threading
+
+from absl.testing import absltest
+
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+
+class MetricsTestCase(absltest.TestCase):
+    def setUp(self):
+        # Keep the metrics made here out of the real registry
+        registry = list(metrics.REGISTRY)
+        self.addCleanup(lambda: metrics.REGISTRY.__setitem__(
+            slice(None), registry))
+
+
+class CounterTest(MetricsTestCase):
+    def test_render(self):
+        counter = Counter("errors_total", "Errors.", ["error"])
+        counter.labels("Oops").inc()
+        counter.labels("Oops").inc(2)
+        counter.labels('say "hi"\n').inc()
+        self.assertEqual(counter.render(), "\n".join([
+            "# HELP errors_total Errors.",
+            "# TYPE errors_total counter",
+            'errors_total{error="Oops"} 3',
+            r'errors_total{error="say \"hi\"\n"} 1',
+        ]) + "\n")
+
+    def test_unlabelled(self):
+        counter = Counter("things_total", "Things.")
+        counter.inc()
+        self.assertIn("things_total 1\n", counter.render())
+
+    def test_wrong_labels(self):
+        with self.assertRaises(ValueError):
+            Counter("things_total", "Things.", ["a"]).labels("x", "y")
+
+    def test_threads_add_up(self):
+        counter = Counter("things_total", "Things.")
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels().value(), 8000)
+
+    def test_exited_threads_folded(self):
+        counter = Counter("things_total", "Things.")
+        for _ in range(100):
+            thread = threading.Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+        self.assertEqual(counter.labels().value(), 100)
+        # Just the base shard
+        self.assertLen(counter.labels().shards(), 1)
+
+    def test_reset_after_fork(self):
+        counter = Counter("things_total", "Things.")
+        counter.inc(5)
+        self.assertIn(counter.labels(), metrics._SHARDED)
+        # As _reset_after_fork does, without resetting every other metric
+        counter.labels()._reset()
+        self.assertEqual(counter.labels().value(), 0)
+        counter.inc()
+        self.assertEqual(counter.labels().value(), 1)
+
+    def test_abstract(self):
+        class Incomplete(metrics._Family):
+            def new_child(self):
+                return metrics._Counter()
+        with self.assertRaises(TypeError):
+            Incomplete("incomplete", "Missing samples.")
+
+
+class GaugeTest(MetricsTestCase):
+    def test_render(self):
+        gauge = Gauge("budget", "Budgets.", ["budget"])
+        gauge.labels("dice").set(10)
+        gauge.labels("dice").set(5)
+        self.assertEqual(gauge.render(), "\n".join([
+            "# HELP budget Budgets.",
+            "# TYPE budget gauge",
+            'budget{budget="dice"} 5',
+        ]) + "\n")
+
+
+class FunctionTest(MetricsTestCase):
+    def test_render(self):
+        stats = {"hits": 1}
+        counter = Counter("cache_total", "Cache.", ["event"])
+        counter.set_function(lambda: stats["hits"], "hit")
+        stats["hits"] = 3
+        self.assertIn('cache_total{event="hit"} 3\n', counter.render())
+
+    def test_wrong_labels(self):
+        with self.assertRaises(ValueError):
+            Gauge("size", "Size.", ["cache"]).set_function(lambda: 1)
+
+
+class HistogramTest(MetricsTestCase):
+    def test_exited_threads_folded(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(1,))
+        for value in (0.5, 2):
+            thread = threading.Thread(target=histogram.observe, args=(value,))
+            thread.start()
+            thread.join()
+        self.assertLen(histogram.labels().shards(), 1)
+        self.assertEqual(histogram.labels().snapshot(), ([1, 1], 2.5))
+
+    def test_render(self):
+        histogram = Histogram("latency_seconds", "Latency.", ["stage"],
+                              buckets=[0.5, 0.1])
+        child = histogram.labels("parse")
+        child.observe(0.05)
+        child.observe(0.1)
+        child.observe(2)
+        self.assertEqual(histogram.render(), "\n".join([
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{stage="parse",le="0.1"} 2',
+            'latency_seconds_bucket{stage="parse",le="0.5"} 2',
+            'latency_seconds_bucket{stage="parse",le="+Inf"} 3',
+            'latency_seconds_sum{stage="parse"} 2.15',
+            'latency_seconds_count{stage="parse"} 3',
+        ]) + "\n")
+
+    def test_time(self):
+        histogram = Histogram("latency_seconds", "Latency.")
+        with self.assertRaises(KeyError):
+            with histogram.time():
+                raise KeyError()
+        counts, total = histogram.labels().snapshot()
+        self.assertEqual(sum(counts), 1)
+        self.assertGreaterEqual(total, 0)
+
+    def test_registry(self):
+        Histogram("latency_seconds", "Latency.").observe(1)
+        Counter("things_total", "Things.").inc()
+        rendered = metrics.render()
+        self.assertIn("latency_seconds_count 1\n", rendered)
+        self.assertIn("things_total 1\n", rendered)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import tempfile
+import threading
+
+from absl.testing import absltest
+from unittest import mock
+from lark import Lark
+
+import parser
+from parser import (
+    compile_parsers, save_parsers, load_parsers, get_parser, get_fast_parser,
+    parse, PARSES)
+
+
+class ParserCacheTest(absltest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "parser.pickle")
+
+    def test_round_trip(self):
+        save_parsers(compile_parsers(), self.path)
+        fast, full = load_parsers(self.path)
+        self.assertEqual(fast.parse("2d6 plus 4", start="start"),
+                         get_fast_parser().parse("2d6 plus 4", start="start"))
+        self.assertEqual(full.parse("2d6 plus 4"),
+                         get_parser().parse("2d6 plus 4"))
+
+    def test_missing(self):
+        self.assertIsNone(load_parsers(self.path))
+
+    def test_stale_hash(self):
+        with open(self.path, "wb") as f:
+            pickle.dump("not the hash", f)
+            pickle.dump(None, f)
+        self.assertIsNone(load_parsers(self.path))
+
+    def test_initialize_falls_back_to_compile(self):
+        with mock.patch.object(parser, "_PARSER", None), \
+                mock.patch.object(parser, "_FAST_PARSER", None), \
+                mock.patch.object(parser, "load_parsers", return_value=None):
+            parser.initialize_parser()
+            self.assertIsInstance(get_parser(), Lark)
+            self.assertIsInstance(get_fast_parser(), Lark)
+
+    def test_initialized_once(self):
+        parsers = (get_fast_parser(), get_parser())
+        with mock.patch.object(parser, "_PARSER", None), \
+                mock.patch.object(parser, "_FAST_PARSER", None), \
+                mock.patch.object(parser, "load_parsers",
+                                  return_value=parsers) as load:
+            threads = [threading.Thread(target=get_parser)
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            load.assert_called_once()
+
+
+class ParseTest(absltest.TestCase):
+    CORPUS = [
+        "3d20 + 5", "2d6 plus 4", "(1+2)*3", "d20", "2 6 sided dice",
+        "3 cube", "1d20 with advantage", "death saving throw",
+        "critical to hit with a longsword", "3d20 + fireball at level 11",
+        "level 5 fireball", "disintegrate at 7th level", "2d(1d4)",
+    ]
+
+    def test_lalr_matches_earley(self):
+        for spec in self.CORPUS:
+            self.assertEqual(
+                get_fast_parser().parse(spec, start="start"),
+                get_parser().parse(spec), spec)
+
+    def test_lalr_counted(self):
+        before = PARSES.labels("lalr").value()
+        parse("2d6 plus 4")
+        self.assertEqual(PARSES.labels("lalr").value(), before + 1)
+
+    def test_falls_back_to_earley(self):
+        before = PARSES.labels("earley_fallback").value()
+        self.assertEqual(parse("2d6d8"), get_parser().parse("2d6d8"))
+        self.assertEqual(PARSES.labels("earley_fallback").value(),
+                         before + 1)
+
+    def test_sum_start(self):
+        self.assertEqual(parse("1d6", start="sum"),
+                         get_parser().parse("1d6", start="sum"))
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+from array import array
+import random
+
+from absl.testing import absltest
+
+import sampling
+from exceptions import ImpossibleDiceError
+from sampling import (
+    check_dice, roll_dice, dice_total, dice_list, DiceResults)
+
+
+class RollDiceTest(absltest.TestCase):
+    def test_random_module_like(self):
+        rolls = roll_dice(1000, 6, random.Random(1))
+        self.assertIsInstance(rolls, array)
+        self.assertLen(rolls, 1000)
+        self.assertEqual(set(rolls), set(range(1, 7)))
+
+    def test_seeded(self):
+        self.assertEqual(roll_dice(10, 20, random.Random(1)),
+                         roll_dice(10, 20, random.Random(1)))
+
+    def test_huge_dice(self):
+        rolls = roll_dice(3, 2**70, random.Random(1))
+        self.assertIsInstance(rolls, list)
+        self.assertLen(rolls, 3)
+        self.assertEqual(dice_total(rolls), sum(rolls))
+
+    def test_uniform_past_double_precision(self):
+        # floor(random() * 2**62) would only give multiples of 2**9, plus 1
+        rolls = roll_dice(10, 2**62, random.Random(1))
+        self.assertIsInstance(rolls, array)
+        self.assertNotEqual({roll % 512 for roll in rolls}, {1})
+        for roll in rolls:
+            self.assertBetween(roll, 1, 2**62)
+
+    def test_default_rng(self):
+        rolls = dice_list(roll_dice(5, 4))
+        self.assertLen(rolls, 5)
+        for roll in rolls:
+            self.assertIsInstance(roll, int)
+            self.assertBetween(roll, 1, 4)
+
+    def test_check_dice(self):
+        check_dice(1, 1)
+        with self.assertRaisesRegex(ImpossibleDiceError, "0 dice"):
+            check_dice(0, 6)
+        with self.assertRaisesRegex(ImpossibleDiceError, "-2 sided"):
+            check_dice(1, -2)
+
+    def test_total(self):
+        self.assertEqual(dice_total(array('q', [1, 2, 3])), 6)
+
+
+class DiceResultsTest(absltest.TestCase):
+    def setUp(self):
+        self.results = DiceResults()
+        self.results.extend(array('q', [3, 1, 4]))
+        self.results.extend([2**70, 5])
+        if sampling.numpy is not None:
+            self.results.extend(sampling.numpy.array([9, 2, 6, 5, 3, 5, 8]))
+        else:
+            self.results.extend(array('q', [9, 2, 6, 5, 3, 5, 8]))
+
+    def test_in_order(self):
+        dice = [3, 1, 4, 2**70, 5, 9, 2, 6, 5, 3, 5, 8]
+        self.assertLen(self.results, 12)
+        self.assertEqual(self.results.tolist(), dice)
+        self.assertEqual(list(self.results), dice)
+        self.assertEqual(self.results, dice)
+        for die in self.results:
+            self.assertIsInstance(die, int)
+
+    def test_extremes(self):
+        self.assertEqual(self.results.extremes(2), ([2**70, 9], [1, 2]))
+        self.assertEqual(self.results.extremes(20)[1],
+                         sorted(self.results.tolist()))
+
+    def test_empty(self):
+        self.assertEqual(DiceResults(), [])
+        self.assertEqual(DiceResults().extremes(3), ([], []))
+
+
+@absltest.skipIf(sampling.numpy is None, "numpy isn't installed")
+class NumpyRollDiceTest(absltest.TestCase):
+    def test_numpy(self):
+        rng = sampling.numpy.random.default_rng(1)
+        rolls = roll_dice(1000, 6, rng)
+        self.assertEqual(set(dice_list(rolls)), set(range(1, 7)))
+        self.assertEqual(dice_total(rolls), sum(dice_list(rolls)))
+        self.assertIsInstance(dice_total(rolls), int)
+
+    def test_numpy_huge_dice(self):
+        rng = sampling.numpy.random.default_rng(1)
+        rolls = roll_dice(2, 2**70, rng)
+        self.assertLen(rolls, 2)
+
+    def test_total_does_not_overflow(self):
+        rolls = sampling.numpy.array([2**62, 2**62, 2**62])
+        self.assertEqual(dice_total(rolls), 3 * 2**62)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+from absl.testing import absltest
+from unittest import mock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy is not None:
+    import simulation
+    from simulation import simulate_tree, EvalTrials
+from dice_calculator import simulate
+from exceptions import ImpossibleDiceError, IncalculableOddsError
+from ir import evaluate, Node
+
+
+@absltest.skipIf(numpy is None, "numpy isn't installed")
+class SimulationTest(absltest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.default_rng(1)
+
+    def test_constant(self):
+        values, counts = simulate_tree(3, 10, self.rng)
+        self.assertEqual(values.tolist(), [3])
+        self.assertEqual(counts.tolist(), [10])
+
+    def test_dice_range(self):
+        values, counts = simulate_tree(Node("roll_n", 2, 6), 10000,
+                                       self.rng)
+        self.assertEqual(values.tolist(), list(range(2, 13)))
+        self.assertEqual(counts.sum(), 10000)
+
+    def test_sparse_results(self):
+        values, counts = simulate_tree(Node("roll_n", 1, 10**12), 1000,
+                                       self.rng)
+        self.assertEqual(counts.sum(), 1000)
+        self.assertEqual(values.tolist(), sorted(values.tolist()))
+        self.assertBetween(int(values[0]), 1, 10**12)
+
+    def test_no_trials(self):
+        result = simulate("3d6", 0)
+        self.assertEqual(result.histogram(), {})
+        self.assertEqual(result.summary()["trials"], 0)
+
+    def test_many_dice_in_blocks(self):
+        with mock.patch.object(simulation, "BATCH_DICE", 10):
+            results = evaluate(Node("roll_n", 25, 1),
+                               EvalTrials(4, self.rng))
+        self.assertEqual(results.tolist(), [25] * 4)
+
+    def test_random_count(self):
+        results = evaluate(Node("roll_n", Node("roll_n", 1, 3), 1),
+                           EvalTrials(1000, self.rng))
+        self.assertEqual(set(results.tolist()), {1, 2, 3})
+
+    def test_random_sides(self):
+        results = evaluate(Node("roll_n", 1, Node("roll_n", 1, 2)),
+                           EvalTrials(1000, self.rng))
+        self.assertEqual(set(results.tolist()), {1, 2})
+
+    def test_operations(self):
+        node = Node("sub",
+                    Node("mul", Node("max", Node("roll_n", 1, 1), 3), 2),
+                    Node("min", Node("roll_n", 1, 1), 4))
+        results = evaluate(node, EvalTrials(5, self.rng))
+        self.assertEqual(results.tolist(), [5] * 5)
+
+    def test_batches_merge(self):
+        with mock.patch.object(simulation, "BATCH_TRIALS", 7):
+            values, counts = simulate_tree(Node("roll_n", 1, 4), 100,
+                                           self.rng)
+        self.assertEqual(values.tolist(), [1, 2, 3, 4])
+        self.assertEqual(counts.sum(), 100)
+
+    def test_impossible(self):
+        with self.assertRaises(ImpossibleDiceError):
+            simulate_tree(Node("roll_n", Node("sub", Node("roll_n", 1, 2), 2),
+                               6), 100, self.rng)
+
+    def test_too_big(self):
+        with self.assertRaises(IncalculableOddsError):
+            simulate_tree(Node("roll_n", 1, 2**64), 10, self.rng)
+        with self.assertRaises(IncalculableOddsError):
+            simulate_tree(Node("roll_n", 4, 2**62), 10, self.rng)
+        with self.assertRaises(IncalculableOddsError):
+            simulate("1d1000000000000", 1000).distribution()
+
+    def test_overflow(self):
+        for dice_spec in ("(1d1000000000000) * (1d1000000000000)",
+                          "1d6 - 10000000000000000000",
+                          "1d9000000000000000000 + 1d9000000000000000000"):
+            with self.assertRaises(IncalculableOddsError, msg=dice_spec):
+                simulate(dice_spec, 10)
+
+    def test_spec(self):
+        result = simulate("1d20 with advantage", 100000)
+        self.assertEqual(result.trials, 100000)
+        self.assertAlmostEqual(result.distribution().mean(), 13.825,
+                               delta=0.1)
+        self.assertEqual(sum(result.histogram().values()), 100000)
+        summary = result.summary()
+        self.assertGreater(summary["trials_per_second"], 0)
+        self.assertEqual(summary["max"], 20)
+        self.assertAlmostEqual(summary["mean"], 13.825, delta=0.1)
+        self.assertEqual(summary["p50"],
+                         result.distribution().summary()["p50"])
+
+    def test_process_pool(self):
+        result = simulation.simulate("2d6", 1001, processes=2, seed=1)
+        self.assertEqual(result.counts.sum(), 1001)
+        self.assertEqual(result.values[0], 2)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import threading
+
+from absl.testing import absltest
+from unittest import mock
+
+from dice_calculator import normalize_spec, PLAN_CACHE
+import warmup
+
+
+class WarmUpTest(absltest.TestCase):
+    def setUp(self):
+        ready = mock.patch.object(warmup, "_READY", threading.Event())
+        ready.start()
+        self.addCleanup(ready.stop)
+
+    def test_ready_after_warm_up(self):
+        self.assertFalse(warmup.is_ready())
+        warmup.warm_up()
+        self.assertTrue(warmup.is_ready())
+
+    def test_resolves_named_objects(self):
+        PLAN_CACHE.clear()
+        warmup.warm_up()
+        self.assertIsNotNone(PLAN_CACHE.get(normalize_spec("Fireball")))
+        self.assertIsNotNone(PLAN_CACHE.get(normalize_spec("Longsword")))
+
+    def test_only_once(self):
+        warmup.warm_up()
+        with mock.patch.object(warmup, "resolve") as resolve:
+            warmup.warm_up()
+        resolve.assert_not_called()
+
+    def test_in_background(self):
+        warmup.warm_up_in_background().join()
+        self.assertTrue(warmup.is_ready())
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -5,13 +5,16 @@ from typing import Any
 
 
 def pprint(obj: Any, depth: int = 0) -> str:
-    out = ""
-    if isinstance(obj, Tree):
-        out = " "*depth + "- " + obj.data + ":\n"
-        for child in obj.children:
-            out += pprint(child, depth+1)
-    elif isinstance(obj, Token):
-        out += " "*depth + "- " + obj.type + ": " + obj.value + "\n"
-    else:
-        out += " "*depth + "- " + repr(obj) + "\n"
-    return out
+    # Iterative, and joined once at the end, as trees can be very deep
+    lines = []
+    stack = [(obj, depth)]
+    while stack:
+        obj, depth = stack.pop()
+        if isinstance(obj, Tree):
+            lines.append(" "*depth + "- " + obj.data + ":\n")
+            stack.extend((child, depth+1) for child in reversed(obj.children))
+        elif isinstance(obj, Token):
+            lines.append(" "*depth + "- " + obj.type + ": " + obj.value + "\n")
+        else:
+            lines.append(" "*depth + "- " + repr(obj) + "\n")
+    return "".join(lines)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Builds everything requests need up front, so that no request has to.
+
+Under gunicorn.conf.py's preload mode this runs once in the master before it
+forks, and the workers share the result copy on write. Otherwise each worker
+warms itself up in the background as it starts.
+"""
+
+from collections import Counter
+import threading
+import time
+
+from absl import logging
+
+from dice_calculator import resolve
+from exceptions import RecognitionError, UnfulfillableRequestError
+from knowledge import get_damage_table
+from knowledge_store import spells, weapons
+from parser import get_parser, get_fast_parser
+
+_READY = threading.Event()
+_LOCK = threading.Lock()
+
+
+def is_ready() -> bool:
+    """Whether warm_up has finished."""
+    return _READY.is_set()
+
+
+def warm_up():
+    """Loads the parsers and damage table and resolves every named object.
+
+    Resolving every spell and weapon fills the plan cache with them and
+    flags any that can't be rolled by name. Spells that do no damage are
+    expected to fail.
+    """
+    with _LOCK:
+        if _READY.is_set():
+            return
+        start = time.process_time()
+        get_fast_parser()
+        get_parser()
+        get_damage_table()
+        outcomes = Counter()
+        for name in ([s.name for s in spells()] +
+                     [w.name for w in weapons()]):
+            try:
+                resolve(name)
+                outcomes["resolved"] += 1
+            except RecognitionError:
+                logging.warning("Couldn't recognise %r during warm up", name)
+                outcomes["unrecognised"] += 1
+            except UnfulfillableRequestError:
+                outcomes["unrollable"] += 1
+        end = time.process_time()
+        logging.info("warming up took %f seconds: %s", end-start,
+                     dict(outcomes))
+        _READY.set()
+
+
+def warm_up_in_background() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warm_up", daemon=True)
+    thread.start()
+    return thread